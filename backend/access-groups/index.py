@@ -142,19 +142,35 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 conn = get_db_connection()
                 cur = conn.cursor()
                 
-                # If id is provided, return single access group with permissions
+                # If id is provided, return single access group with permissions,
+                # assembled as a JSON document in one statement
                 if access_group_id:
                     cur.execute('''
-                        SELECT ag.id, ag.group_name as name, ag.description, ag.is_system, ag.created_at
+                        SELECT json_build_object('access_group', json_build_object(
+                            'id', ag.id,
+                            'name', ag.group_name,
+                            'description', ag.description,
+                            'is_system', ag.is_system,
+                            'created_at', ag.created_at,
+                            'permissions', COALESCE((
+                                SELECT json_agg(json_build_object(
+                                    'id', p.id, 'code', p.code, 'name', p.name,
+                                    'description', p.description, 'category', p.category
+                                ) ORDER BY p.category, p.code)
+                                FROM t_p66738329_webapp_functionality.permissions p
+                                INNER JOIN t_p66738329_webapp_functionality.access_group_permissions agp ON agp.permission_id = p.id
+                                WHERE agp.access_group_id = ag.id
+                            ), '[]'::json)
+                        ))::text as body
                         FROM t_p66738329_webapp_functionality.access_groups ag
                         WHERE ag.id = %s
                     ''', (access_group_id,))
                     
                     access_group = cur.fetchone()
+                    cur.close()
+                    conn.close()
                     
                     if not access_group:
-                        cur.close()
-                        conn.close()
                         return {
                             'statusCode': 404,
                             'headers': cors_headers,
@@ -162,25 +178,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                             'isBase64Encoded': False
                         }
                     
-                    access_group = dict(access_group)
-                    
-                    # Get permissions for this access group
-                    cur.execute('''
-                        SELECT p.id, p.code, p.name, p.description, p.category
-                        FROM t_p66738329_webapp_functionality.permissions p
-                        INNER JOIN t_p66738329_webapp_functionality.access_group_permissions agp ON agp.permission_id = p.id
-                        WHERE agp.access_group_id = %s
-                        ORDER BY p.category, p.code
-                    ''', (access_group_id,))
-                    
-                    access_group['permissions'] = [dict(row) for row in cur.fetchall()]
-                    cur.close()
-                    conn.close()
-                    
                     return {
                         'statusCode': 200,
                         'headers': cors_headers,
-                        'body': json.dumps({'access_group': access_group}, default=str),
+                        'body': access_group['body'],
                         'isBase64Encoded': False
                     }
                 
@@ -285,6 +286,61 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'permissions': permissions}),
                     'isBase64Encoded': False
                 }
+            
+            elif resource == 'matrix':
+                if not check_permission(current_user['id'], 'access_groups.view'):
+                    return {
+                        'statusCode': 403,
+                        'headers': cors_headers,
+                        'body': json.dumps({'error': 'Permission denied'}),
+                        'isBase64Encoded': False
+                    }
+                
+                conn = get_db_connection()
+                cur = conn.cursor()
+                
+                # Groups, permissions and grants in one statement: each group carries
+                # the positions of its permissions in the ordered permissions array
+                cur.execute('''
+                    WITH perms AS (
+                        SELECT p.id, p.code, p.name, p.category,
+                               (ROW_NUMBER() OVER (ORDER BY p.category, p.code) - 1)::int as idx
+                        FROM t_p66738329_webapp_functionality.permissions p
+                    ),
+                    grants AS (
+                        SELECT agp.access_group_id, array_agg(perms.idx ORDER BY perms.idx) as permission_indexes
+                        FROM t_p66738329_webapp_functionality.access_group_permissions agp
+                        INNER JOIN perms ON perms.id = agp.permission_id
+                        GROUP BY agp.access_group_id
+                    )
+                    SELECT json_build_object(
+                        'permissions', COALESCE((
+                            SELECT json_agg(json_build_object('id', id, 'code', code, 'name', name, 'category', category) ORDER BY idx)
+                            FROM perms
+                        ), '[]'::json),
+                        'groups', COALESCE((
+                            SELECT json_agg(json_build_object(
+                                'id', ag.id,
+                                'name', ag.group_name,
+                                'is_system', ag.is_system,
+                                'permission_indexes', COALESCE(g.permission_indexes, '{}'::int[])
+                            ) ORDER BY ag.group_name)
+                            FROM t_p66738329_webapp_functionality.access_groups ag
+                            LEFT JOIN grants g ON g.access_group_id = ag.id
+                        ), '[]'::json)
+                    )::text as body
+                ''')
+                
+                body = cur.fetchone()['body']
+                cur.close()
+                conn.close()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': cors_headers,
+                    'body': body,
+                    'isBase64Encoded': False
+                }
         
         elif method == 'POST':
             if not check_permission(current_user['id'], 'access_groups.create'):
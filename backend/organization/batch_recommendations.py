@@ -0,0 +1,163 @@
+'''
+Business: Offline precomputation of course and trainer recommendations for every employee
+Args: command line --mode (index, tfidf or lsh), --workers; DATABASE_URL in environment
+Returns: rows in recommendation_cache, the same table the online recommendations read serves from
+'''
+
+import argparse
+import csv
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import psycopg2
+from psycopg2.extras import RealDictCursor
+import recommender
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+
+# Users of one company are split into shards of at most this size, so a large clinic network spreads over workers
+SHARD_SIZE = 2000
+
+WORKER_INDEX = {}
+
+def get_db_connection():
+    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor, options='-c search_path=t_p66738329_webapp_functionality')
+
+def load_snapshot(conn):
+    """Catalog, its version and every user's completions read from one consistent snapshot"""
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    cur = conn.cursor()
+    
+    cur.execute("SELECT version FROM cache_versions WHERE scope = 'catalog'")
+    row = cur.fetchone()
+    catalog_version = row['version'] if row else 0
+    
+    courses, trainers = recommender.load_catalog(cur)
+    
+    cur.execute('''
+        WITH completed_courses AS (
+            SELECT user_id, array_agg(course_id ORDER BY completed_at, course_id) as ids
+            FROM course_progress
+            WHERE status = 'completed'
+            GROUP BY user_id
+        ),
+        completed_trainers AS (
+            SELECT user_id, array_agg(trainer_id ORDER BY completed_at, trainer_id) as ids
+            FROM trainer_progress
+            WHERE status = 'completed'
+            GROUP BY user_id
+        )
+        SELECT u.id as user_id, COALESCE(u.company_id, 0) as company_id,
+               COALESCE(upv.version, 0) as progress_version,
+               COALESCE(cc.ids, '{}') as course_ids, COALESCE(ct.ids, '{}') as trainer_ids
+        FROM users u
+        LEFT JOIN user_progress_versions upv ON upv.user_id = u.id
+        LEFT JOIN completed_courses cc ON cc.user_id = u.id
+        LEFT JOIN completed_trainers ct ON ct.user_id = u.id
+        WHERE u.is_blocked = FALSE
+        ORDER BY u.company_id, u.id
+    ''')
+    users = [(row['user_id'], row['company_id'], row['progress_version'], row['course_ids'], row['trainer_ids']) for row in cur.fetchall()]
+    
+    cur.close()
+    conn.commit()
+    return catalog_version, courses, trainers, users
+
+def shard_by_company(users):
+    shards = []
+    current_company = None
+    for user in users:
+        if user[1] != current_company or len(shards[-1]) >= SHARD_SIZE:
+            shards.append([])
+            current_company = user[1]
+        shards[-1].append(user)
+    return shards
+
+def init_worker(courses, trainers, signatures=None):
+    WORKER_INDEX['index'] = recommender.CatalogIndex(courses, trainers)
+    if signatures is not None:
+        WORKER_INDEX['index'].lsh = recommender.LshIndex(WORKER_INDEX['index'], signatures)
+
+def compute_shard(mode, shard):
+    index = WORKER_INDEX['index']
+    if mode == 'tfidf':
+        recommend = recommender.recommend_tfidf
+    elif mode == 'lsh':
+        recommend = lambda index, course_ids, trainer_ids: recommender.recommend(index, course_ids, trainer_ids, similarities=index.lsh.similarities)
+    else:
+        recommend = recommender.recommend
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for user_id, _, progress_version, course_ids, trainer_ids in shard:
+        writer.writerow([user_id, progress_version, recommender.json_body(recommend(index, course_ids, trainer_ids))])
+    return len(shard), buffer.getvalue()
+
+def precompute_recommendations(mode: str = 'index', workers: int = None):
+    started = time.time()
+    
+    read_conn = get_db_connection()
+    try:
+        catalog_version, courses, trainers, users = load_snapshot(read_conn)
+    finally:
+        read_conn.close()
+    
+    shards = shard_by_company(users)
+    print(f"[BATCH] catalog v{catalog_version}: {len(courses)} courses, {len(trainers)} trainers, {len(users)} users in {len(shards)} shards")
+    
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    try:
+        # Signatures are read and refreshed once here, workers only rebuild the buckets
+        signatures = None
+        if mode == 'lsh':
+            signatures = recommender.get_lsh_index(cur, recommender.CatalogIndex(courses, trainers)).signatures
+            conn.commit()
+        
+        cur.execute('''
+            CREATE TEMP TABLE recommendation_batch (
+                user_id INTEGER,
+                progress_version BIGINT,
+                result TEXT
+            ) ON COMMIT DROP
+        ''')
+        
+        done = 0
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(courses, trainers, signatures)) as pool:
+            futures = [pool.submit(compute_shard, mode, shard) for shard in shards]
+            for future in as_completed(futures):
+                count, rows = future.result()
+                cur.copy_expert('COPY recommendation_batch (user_id, progress_version, result) FROM STDIN WITH (FORMAT csv)', io.StringIO(rows))
+                done += count
+                print(f"[BATCH] {done}/{len(users)} users")
+        
+        # A result computed online from newer versions is kept
+        cur.execute('''
+            INSERT INTO recommendation_cache (user_id, mode, catalog_version, progress_version, result, computed_at)
+            SELECT user_id, %s, %s, progress_version, result, NOW()
+            FROM recommendation_batch
+            ON CONFLICT (user_id, mode) DO UPDATE SET
+                catalog_version = EXCLUDED.catalog_version,
+                progress_version = EXCLUDED.progress_version,
+                result = EXCLUDED.result,
+                computed_at = EXCLUDED.computed_at
+            WHERE recommendation_cache.catalog_version <= EXCLUDED.catalog_version
+              AND recommendation_cache.progress_version <= EXCLUDED.progress_version
+        ''', (mode, catalog_version))
+        written = cur.rowcount
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    
+    print(f"[BATCH] wrote {written} rows in {time.time() - started:.1f}s")
+    return written
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute recommendations for all users')
+    parser.add_argument('--mode', choices=['index', 'tfidf', 'lsh'], default='index')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    precompute_recommendations(args.mode, args.workers)
@@ -0,0 +1,153 @@
+'''
+Business: Compaction of the learning_events log into daily rollups and the current progress rows, plus the scheduled flush of buffered progress
+Args: command line --retain-months; DATABASE_URL in environment
+Returns: rows in learning_daily_rollups, refreshed progress percentages, an emptied progress_staging, monthly partitions created ahead and old ones dropped
+'''
+
+import argparse
+import os
+import time
+from datetime import date
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from index import flush_progress_staging
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+
+# Gap between two events of one item that still counts as continuous activity
+SESSION_GAP_SECONDS = 300
+
+# Events newer than this are left for the next run, so transactions still in flight are not skipped
+COMPACTION_LAG_SECONDS = 120
+
+PARTITION_PREFIX = 'learning_events_'
+
+# Monthly partitions created ahead of the current month
+PARTITION_MONTHS_AHEAD = 2
+
+def get_db_connection():
+    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor, options='-c search_path=t_p66738329_webapp_functionality')
+
+def fold_into_rollups(cur, since, until) -> int:
+    """Add events in (since, until] to daily rollups; time-on-task uses the gap to the previous event, looking back before since"""
+    cur.execute('''
+        WITH window_events AS (
+            SELECT user_id, item_type, item_id, event_type, progress_percent, occurred_at,
+                   occurred_at - LAG(occurred_at) OVER (PARTITION BY user_id, item_type, item_id ORDER BY occurred_at, id) as gap
+            FROM learning_events
+            WHERE occurred_at > %(since)s - %(gap)s * INTERVAL '1 second' AND occurred_at <= %(until)s
+        )
+        INSERT INTO learning_daily_rollups as r (day, user_id, item_type, item_id, events_count, active_seconds, max_percent, completed)
+        SELECT occurred_at::date, user_id, item_type, item_id, COUNT(*),
+               COALESCE(SUM(EXTRACT(EPOCH FROM gap)) FILTER (WHERE gap <= %(gap)s * INTERVAL '1 second'), 0)::int,
+               COALESCE(MAX(progress_percent), 0),
+               bool_or(event_type = 'completed')
+        FROM window_events
+        WHERE occurred_at > %(since)s
+        GROUP BY occurred_at::date, user_id, item_type, item_id
+        ON CONFLICT (day, user_id, item_type, item_id) DO UPDATE SET
+            events_count = r.events_count + EXCLUDED.events_count,
+            active_seconds = r.active_seconds + EXCLUDED.active_seconds,
+            max_percent = GREATEST(r.max_percent, EXCLUDED.max_percent),
+            completed = r.completed OR EXCLUDED.completed
+    ''', {'since': since, 'until': until, 'gap': SESSION_GAP_SECONDS})
+    return cur.rowcount
+
+def fold_into_progress(cur, since, until) -> int:
+    """Apply the latest percentage of each item to its progress row when the row is older and still in the same status"""
+    cur.execute('''
+        WITH latest AS (
+            SELECT DISTINCT ON (user_id, item_type, item_id) user_id, item_type, item_id, event_type, status, progress_percent, occurred_at
+            FROM learning_events
+            WHERE occurred_at > %(since)s AND occurred_at <= %(until)s
+            ORDER BY user_id, item_type, item_id, occurred_at DESC, id DESC
+        ),
+        courses AS (
+            UPDATE course_progress p
+            SET progress_percent = l.progress_percent, last_activity_at = l.occurred_at
+            FROM latest l
+            WHERE l.item_type = 'course' AND l.event_type = 'progress'
+              AND p.user_id = l.user_id AND p.course_id = l.item_id AND p.status = l.status AND p.last_activity_at < l.occurred_at
+            RETURNING 1
+        ),
+        trainers AS (
+            UPDATE trainer_progress p
+            SET progress_percent = l.progress_percent, last_activity_at = l.occurred_at
+            FROM latest l
+            WHERE l.item_type = 'trainer' AND l.event_type = 'progress'
+              AND p.user_id = l.user_id AND p.trainer_id = l.item_id AND p.status = l.status AND p.last_activity_at < l.occurred_at
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM courses) + (SELECT COUNT(*) FROM trainers) as updated
+    ''', {'since': since, 'until': until})
+    return cur.fetchone()['updated']
+
+def maintain_partitions(cur, compacted_until, retain_months: int):
+    """Create partitions for the next months and drop monthly partitions older than retain_months that are fully compacted"""
+    # Rows that already landed in the default partition are moved into the new one by the function
+    for months in range(1, PARTITION_MONTHS_AHEAD + 1):
+        cur.execute("SELECT create_learning_events_partition((CURRENT_DATE + %s * INTERVAL '1 month')::DATE)", (months,))
+    
+    month = compacted_until.year * 12 + compacted_until.month - 1 - retain_months
+    cutoff = date(month // 12, month % 12 + 1, 1)
+    
+    cur.execute('''
+        SELECT c.relname
+        FROM pg_inherits i
+        INNER JOIN pg_class c ON c.oid = i.inhrelid
+        INNER JOIN pg_class p ON p.oid = i.inhparent
+        INNER JOIN pg_namespace n ON n.oid = p.relnamespace
+        WHERE p.relname = 'learning_events' AND n.nspname = 't_p66738329_webapp_functionality'
+    ''')
+    dropped = []
+    for row in cur.fetchall():
+        suffix = row['relname'][len(PARTITION_PREFIX):]
+        if not suffix.isdigit():
+            continue
+        if date(int(suffix[:4]), int(suffix[4:]), 1) < cutoff:
+            cur.execute(f"DROP TABLE {row['relname']}")
+            dropped.append(row['relname'])
+    return dropped
+
+def compact_learning_events(retain_months: int = 6):
+    started = time.time()
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    try:
+        # Buffered percentages of idle users would otherwise wait for the next write on a warm instance
+        flushed = flush_progress_staging(cur)
+        conn.commit()
+        
+        # The lock on the state row keeps two runs from folding the same events twice
+        cur.execute('SELECT compacted_until FROM learning_events_compaction WHERE id = 1 FOR UPDATE')
+        since = cur.fetchone()['compacted_until']
+        cur.execute("SELECT NOW()::timestamp - %s * INTERVAL '1 second' as until", (COMPACTION_LAG_SECONDS,))
+        until = cur.fetchone()['until']
+        
+        rollups = fold_into_rollups(cur, since, until)
+        progress = fold_into_progress(cur, since, until)
+        
+        cur.execute('UPDATE learning_events_compaction SET compacted_until = %s, updated_at = CURRENT_TIMESTAMP WHERE id = 1', (until,))
+        conn.commit()
+        
+        # Partition maintenance runs in its own transaction, so a failure there never undoes the fold
+        try:
+            dropped = maintain_partitions(cur, until, retain_months)
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            dropped = None
+            print(f"[COMPACT] partition maintenance failed: {e}")
+    finally:
+        cur.close()
+        conn.close()
+    
+    print(f"[COMPACT] flushed {flushed} buffered rows; {since} .. {until}: {rollups} rollup rows, {progress} progress rows, dropped {dropped or 'no'} partitions in {time.time() - started:.1f}s")
+    return rollups
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fold learning events into daily rollups and progress rows')
+    parser.add_argument('--retain-months', type=int, default=6)
+    args = parser.parse_args()
+    compact_learning_events(args.retain_months)
@@ -6,12 +6,46 @@ Returns: HTTP response with companies/departments/courses/trainers data
 
 import json
 import os
-from typing import Dict, Any
+import select
+import time
+import hashlib
+from datetime import date, datetime
+from typing import Dict, Any, List
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+import recommender
+import tokenizer
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
+# Target size of one stored content chunk, in UTF-8 bytes
+CONTENT_CHUNK_BYTES = 16 * 1024
+
+CONTENT_ITEM_TABLES = {'course': 'courses', 'trainer': 'trainers'}
+
+# Only the beginning of very long content goes into the search vector, which PostgreSQL caps at 1MB
+CONTENT_SEARCH_CHARS = 100 * 1024
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_SIZE_MAX = 100
+
+LIST_PAGE_SIZE = 50
+LIST_PAGE_SIZE_MAX = 100
+
+# Warm-instance cache of org_tree bodies: company_id (or None) -> (version, body)
+ORG_TREE_CACHE = {}
+
+# Warm-instance cache of recommendation bodies: user_id -> {mode: (catalog version, progress version, body)}
+RECOMMENDATION_CACHE = {}
+RECOMMENDATION_CACHE_LIMIT = 5000
+
+# Warm-instance cache of department catalogs: department_id -> (catalog version, org version, {'courses': [...], 'trainers': [...]})
+MY_CATALOG_CACHE = {}
+
+# Buffered progress percentages reach the progress tables at most this long after they were first buffered
+PROGRESS_FLUSH_SECONDS = 30
+PROGRESS_FLUSH = {'at': 0.0}
+
 def get_db_connection():
     return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor, options='-c search_path=t_p66738329_webapp_functionality')
 
@@ -52,6 +86,11 @@ def has_permission(user_id: int, permission_code: str) -> bool:
     
     return result['count'] > 0
 
+def get_cache_version(cur, scope: str) -> int:
+    cur.execute('SELECT version FROM cache_versions WHERE scope = %s', (scope,))
+    row = cur.fetchone()
+    return row['version'] if row else 0
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'GET')
     headers = event.get('headers', {})
@@ -106,10 +145,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return handle_companies(method, user, body_data, headers, cors_headers, event)
         elif entity_type == 'department':
             return handle_departments(method, user, body_data, headers, cors_headers, event)
+        elif entity_type == 'org_tree':
+            return handle_org_tree(method, user, body_data, headers, cors_headers, event)
+        elif entity_type == 'report':
+            return handle_report(method, user, body_data, headers, cors_headers, event)
         elif entity_type == 'course':
             return handle_courses(method, user, body_data, headers, cors_headers, event)
         elif entity_type == 'trainer':
             return handle_trainers(method, user, body_data, headers, cors_headers, event)
+        elif entity_type == 'content':
+            return handle_content(method, user, body_data, headers, cors_headers, event)
+        elif entity_type == 'my_catalog':
+            return handle_my_catalog(method, user, body_data, headers, cors_headers, event)
         elif entity_type == 'recommendations':
             return handle_recommendations(method, user, body_data, headers, cors_headers, event)
         elif entity_type == 'progress':
@@ -136,18 +183,207 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
 
-def calculate_text_similarity(text1, text2):
-    """Calculate text similarity using word intersection/union ratio"""
-    if not text1 or not text2:
-        return 0.0
+PROGRESS_TABLES = {
+    'course': ('t_p66738329_webapp_functionality.course_progress', 'course_id'),
+    'trainer': ('t_p66738329_webapp_functionality.trainer_progress', 'trainer_id')
+}
+
+# Upper bound on events in one batch progress request
+PROGRESS_BATCH_LIMIT = 500
+
+def upsert_progress(cur, progress_type: str, user_id: int, item_id: int, status: str, progress_percent: int) -> Dict:
+    """Insert or update one progress row, returning it with the status it had before as previous_status"""
+    return upsert_progress_rows(cur, progress_type, user_id, [(item_id, status, progress_percent)])[0]
+
+def upsert_progress_rows(cur, progress_type: str, user_id: int, rows: List) -> List[Dict]:
+    """Insert or update progress rows (item_id, status, progress_percent) in one statement, each returned with its previous_status"""
+    table, column = PROGRESS_TABLES[progress_type]
+    cur.execute(f'''
+        WITH incoming AS (
+            SELECT * FROM unnest(%s::int[], %s::varchar[], %s::int[]) AS i(item_id, status, progress_percent)
+        ),
+        previous AS (
+            SELECT p.{column} as item_id, p.status
+            FROM {table} p
+            INNER JOIN incoming i ON i.item_id = p.{column}
+            WHERE p.user_id = %s
+        )
+        INSERT INTO {table} 
+            (user_id, {column}, status, progress_percent, started_at, last_activity_at, completed_at)
+        SELECT %s, item_id, status, progress_percent, NOW(), NOW(), CASE WHEN status = 'completed' THEN NOW() END
+        FROM incoming
+        ON CONFLICT (user_id, {column}) 
+        DO UPDATE SET 
+            status = EXCLUDED.status,
+            progress_percent = EXCLUDED.progress_percent,
+            last_activity_at = NOW(),
+            completed_at = CASE WHEN EXCLUDED.status = 'completed' THEN NOW() ELSE {table}.completed_at END
+        RETURNING *, (SELECT status FROM previous WHERE previous.item_id = {table}.{column}) as previous_status
+    ''', ([r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows], user_id, user_id))
+    by_id = {row[column]: dict(row) for row in cur.fetchall()}
+    return [by_id[int(r[0])] for r in rows]
+
+def ingest_progress_batch(cur, user_id: int, events: List) -> List[Dict]:
+    """Validate and upsert a list of progress events; returns one result per event in input order"""
+    results = [None] * len(events)
+    latest = {'course': {}, 'trainer': {}}
+    for i, event in enumerate(events):
+        progress_type = event.get('type') if isinstance(event, dict) else None
+        if progress_type not in PROGRESS_TABLES or not event.get('id'):
+            results[i] = {'index': i, 'error': 'Missing or invalid type or id'}
+            continue
+        try:
+            item_id = int(event['id'])
+            progress_percent = int(event.get('progress_percent', 0))
+        except (TypeError, ValueError):
+            results[i] = {'index': i, 'error': 'Invalid id or progress_percent'}
+            continue
+        status = event.get('status', 'in_progress')
+        if not isinstance(status, str) or not status:
+            results[i] = {'index': i, 'error': 'Invalid status'}
+            continue
+        if status == 'completed':
+            progress_percent = 100
+        # Several events for one item collapse into the last one
+        latest[progress_type][item_id] = (i, status, progress_percent)
     
-    words1 = set(text1.lower().split())
-    words2 = set(text2.lower().split())
+    changed_completion = False
+    for progress_type, items in latest.items():
+        if not items:
+            continue
+        table = 'courses' if progress_type == 'course' else 'trainers'
+        cur.execute(f'SELECT id FROM t_p66738329_webapp_functionality.{table} WHERE id = ANY(%s)', (list(items),))
+        existing = {row['id'] for row in cur.fetchall()}
+        
+        rows = []
+        for item_id, (i, status, progress_percent) in items.items():
+            if item_id in existing:
+                rows.append((item_id, status, progress_percent))
+            else:
+                results[i] = {'index': i, 'error': f'{progress_type.capitalize()} not found'}
+        if not rows:
+            continue
+        
+        for (item_id, status, _), record in zip(rows, upsert_progress_rows(cur, progress_type, user_id, rows)):
+            previous_status = record.pop('previous_status')
+            changed_completion = changed_completion or status == 'completed' or previous_status == 'completed'
+            results[items[item_id][0]] = {'index': items[item_id][0], 'progress': record}
+        cur.execute('''
+            DELETE FROM t_p66738329_webapp_functionality.progress_staging
+            WHERE user_id = %s AND item_type = %s AND item_id = ANY(%s)
+        ''', (user_id, progress_type, [r[0] for r in rows]))
+        log_learning_events(cur, user_id, [(progress_type, item_id, 'completed' if status == 'completed' else 'progress', status, percent)
+                                           for item_id, status, percent in rows])
     
-    intersection = len(words1 & words2)
-    union = len(words1 | words2)
+    for i, event in enumerate(events):
+        if results[i] is None:
+            results[i] = {'index': i, 'superseded_by': latest[event['type']][int(event['id'])][0]}
     
-    return intersection / union if union > 0 else 0.0
+    if changed_completion:
+        bump_progress_version(cur, user_id)
+    return results
+
+# Score buckets of the per-trainer histogram: 0-9, 10-19, ..., 90-100
+SCORE_BUCKETS = 10
+
+def record_trainer_attempt(cur, user_id: int, trainer_id: int, score: int, duration_seconds: int):
+    """Store an attempt and, in the same statement, bump attempts_count, best_score and the trainer's score histogram"""
+    cur.execute('''
+        WITH attempt AS (
+            INSERT INTO t_p66738329_webapp_functionality.trainer_attempts (user_id, trainer_id, score, duration_seconds)
+            SELECT %s, id, %s, %s FROM t_p66738329_webapp_functionality.trainers WHERE id = %s
+            RETURNING id, user_id, trainer_id, score, duration_seconds
+        ),
+        progress AS (
+            INSERT INTO t_p66738329_webapp_functionality.trainer_progress AS tp
+                (user_id, trainer_id, status, progress_percent, attempts_count, best_score, started_at, last_activity_at)
+            SELECT user_id, trainer_id, 'in_progress', 0, 1, score, NOW(), NOW() FROM attempt
+            ON CONFLICT (user_id, trainer_id) DO UPDATE SET
+                attempts_count = COALESCE(tp.attempts_count, 0) + 1,
+                best_score = GREATEST(tp.best_score, EXCLUDED.best_score),
+                status = CASE WHEN tp.status = 'not_started' THEN 'in_progress' ELSE tp.status END,
+                started_at = COALESCE(tp.started_at, NOW()),
+                last_activity_at = NOW()
+            RETURNING tp.*
+        ),
+        histogram AS (
+            INSERT INTO t_p66738329_webapp_functionality.trainer_score_histogram AS h (trainer_id, bucket, attempts, score_sum, duration_sum)
+            SELECT trainer_id, LEAST(score * %s / 100, %s - 1), 1, score, duration_seconds FROM attempt
+            ON CONFLICT (trainer_id, bucket) DO UPDATE SET
+                attempts = h.attempts + 1,
+                score_sum = h.score_sum + EXCLUDED.score_sum,
+                duration_sum = h.duration_sum + EXCLUDED.duration_sum
+        )
+        SELECT p.*, a.id as attempt_id, a.score, a.duration_seconds
+        FROM progress p, attempt a
+    ''', (user_id, score, duration_seconds, trainer_id, SCORE_BUCKETS, SCORE_BUCKETS))
+    row = cur.fetchone()
+    return dict(row) if row else None
+
+def log_learning_events(cur, user_id: int, events: List):
+    """Append (item_type, item_id, event_type, status, progress_percent) events to the learning_events log"""
+    execute_values(cur, '''
+        INSERT INTO t_p66738329_webapp_functionality.learning_events
+        (user_id, item_type, item_id, event_type, status, progress_percent)
+        VALUES %s
+    ''', [(user_id,) + tuple(event) for event in events])
+
+def stage_progress(cur, progress_type: str, user_id: int, item_id: int, status: str, progress_percent: int):
+    """Buffer an intermediate percentage; returns None (nothing buffered) when the stored row is missing or has another status"""
+    table, column = PROGRESS_TABLES[progress_type]
+    cur.execute(f'''
+        INSERT INTO t_p66738329_webapp_functionality.progress_staging (user_id, item_type, item_id, status, progress_percent)
+        SELECT %s, %s, %s, %s, %s
+        WHERE EXISTS (SELECT 1 FROM {table} WHERE user_id = %s AND {column} = %s AND status = %s)
+        ON CONFLICT (user_id, item_type, item_id) DO UPDATE SET
+            progress_percent = EXCLUDED.progress_percent,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING user_id, item_id as {column}, status, progress_percent, updated_at as last_activity_at
+    ''', (user_id, progress_type, item_id, status, progress_percent, user_id, item_id, status))
+    row = cur.fetchone()
+    return dict(row) if row else None
+
+def discard_staged_progress(cur, progress_type: str, user_id: int, item_id: int):
+    """Drop a buffered percentage that a written-through update makes stale"""
+    cur.execute('''
+        DELETE FROM t_p66738329_webapp_functionality.progress_staging
+        WHERE user_id = %s AND item_type = %s AND item_id = %s
+    ''', (user_id, progress_type, item_id))
+
+def flush_progress_staging(cur) -> int:
+    """Move percentages buffered longer than the flush interval into the progress tables;
+    besides opportunistic calls from buffered writes, compact_learning_events.py runs it on schedule"""
+    cur.execute('''
+        WITH flushed AS (
+            DELETE FROM t_p66738329_webapp_functionality.progress_staging
+            WHERE buffered_at <= NOW() - %s * INTERVAL '1 second'
+            RETURNING *
+        ),
+        courses AS (
+            UPDATE t_p66738329_webapp_functionality.course_progress p
+            SET progress_percent = f.progress_percent, last_activity_at = f.updated_at
+            FROM flushed f
+            WHERE f.item_type = 'course' AND p.user_id = f.user_id AND p.course_id = f.item_id AND p.status = f.status
+            RETURNING 1
+        ),
+        trainers AS (
+            UPDATE t_p66738329_webapp_functionality.trainer_progress p
+            SET progress_percent = f.progress_percent, last_activity_at = f.updated_at
+            FROM flushed f
+            WHERE f.item_type = 'trainer' AND p.user_id = f.user_id AND p.trainer_id = f.item_id AND p.status = f.status
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM courses) + (SELECT COUNT(*) FROM trainers) as flushed
+    ''', (PROGRESS_FLUSH_SECONDS,))
+    return cur.fetchone()['flushed']
+
+def bump_progress_version(cur, user_id: int):
+    cur.execute('''
+        INSERT INTO t_p66738329_webapp_functionality.user_progress_versions (user_id, version)
+        VALUES (%s, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = user_progress_versions.version + 1, updated_at = CURRENT_TIMESTAMP
+    ''', (user_id,))
+    RECOMMENDATION_CACHE.pop(user_id, None)
 
 def handle_progress(method, user, body_data, headers, cors_headers, event):
     conn = get_db_connection()
@@ -174,14 +410,16 @@ def handle_progress(method, user, body_data, headers, cors_headers, event):
                     cp.course_id,
                     c.title,
                     cp.status,
-                    cp.progress_percent,
+                    COALESCE(ps.progress_percent, cp.progress_percent) as progress_percent,
                     cp.started_at,
                     cp.completed_at,
-                    cp.last_activity_at
+                    GREATEST(cp.last_activity_at, ps.updated_at) as last_activity_at
                 FROM t_p66738329_webapp_functionality.course_progress cp
                 INNER JOIN t_p66738329_webapp_functionality.courses c ON c.id = cp.course_id
+                LEFT JOIN t_p66738329_webapp_functionality.progress_staging ps
+                    ON ps.user_id = cp.user_id AND ps.item_type = 'course' AND ps.item_id = cp.course_id AND ps.status = cp.status
                 WHERE cp.user_id = %s
-                ORDER BY cp.last_activity_at DESC
+                ORDER BY last_activity_at DESC
             ''', (target_user_id,))
             courses = [dict(row) for row in cur.fetchall()]
             
@@ -191,14 +429,16 @@ def handle_progress(method, user, body_data, headers, cors_headers, event):
                     tp.trainer_id,
                     t.name as title,
                     tp.status,
-                    tp.progress_percent,
+                    COALESCE(ps.progress_percent, tp.progress_percent) as progress_percent,
                     tp.started_at,
                     tp.completed_at,
-                    tp.last_activity_at
+                    GREATEST(tp.last_activity_at, ps.updated_at) as last_activity_at
                 FROM t_p66738329_webapp_functionality.trainer_progress tp
                 INNER JOIN t_p66738329_webapp_functionality.trainers t ON t.id = tp.trainer_id
+                LEFT JOIN t_p66738329_webapp_functionality.progress_staging ps
+                    ON ps.user_id = tp.user_id AND ps.item_type = 'trainer' AND ps.item_id = tp.trainer_id AND ps.status = tp.status
                 WHERE tp.user_id = %s
-                ORDER BY tp.last_activity_at DESC
+                ORDER BY last_activity_at DESC
             ''', (target_user_id,))
             trainers = [dict(row) for row in cur.fetchall()]
             
@@ -210,6 +450,58 @@ def handle_progress(method, user, body_data, headers, cors_headers, event):
             }
         
         elif method == 'POST':
+            if body_data.get('action') == 'batch':
+                events = body_data.get('events')
+                if not isinstance(events, list) or not events or len(events) > PROGRESS_BATCH_LIMIT:
+                    return {
+                        'statusCode': 400,
+                        'headers': cors_headers,
+                        'body': json.dumps({'error': f'events must be a list of 1 to {PROGRESS_BATCH_LIMIT} items'}),
+                        'isBase64Encoded': False
+                    }
+                
+                results = ingest_progress_batch(cur, user['id'], events)
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': cors_headers,
+                    'body': json.dumps({'results': results, 'failed': sum(1 for r in results if 'error' in r)}, default=str),
+                    'isBase64Encoded': False
+                }
+            
+            if body_data.get('action') == 'attempt':
+                try:
+                    trainer_id = int(body_data.get('id'))
+                    score = int(body_data.get('score'))
+                    duration_seconds = int(body_data.get('duration_seconds', 0))
+                except (TypeError, ValueError):
+                    trainer_id = None
+                if not trainer_id or not 0 <= score <= 100 or duration_seconds < 0:
+                    return {
+                        'statusCode': 400,
+                        'headers': cors_headers,
+                        'body': json.dumps({'error': 'Trainer id, score 0-100 and non-negative duration_seconds required'}),
+                        'isBase64Encoded': False
+                    }
+                
+                attempt = record_trainer_attempt(cur, user['id'], trainer_id, score, duration_seconds)
+                if not attempt:
+                    return {
+                        'statusCode': 404,
+                        'headers': cors_headers,
+                        'body': json.dumps({'error': 'Trainer not found'}),
+                        'isBase64Encoded': False
+                    }
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': cors_headers,
+                    'body': json.dumps(attempt, default=str),
+                    'isBase64Encoded': False
+                }
+            
             # Start or update progress
             progress_type = body_data.get('type')
             item_id = body_data.get('id')
@@ -224,6 +516,25 @@ def handle_progress(method, user, body_data, headers, cors_headers, event):
                     'isBase64Encoded': False
                 }
             
+            try:
+                item_id = int(item_id)
+                progress_percent = int(progress_percent or 0)
+            except (TypeError, ValueError):
+                return {
+                    'statusCode': 400,
+                    'headers': cors_headers,
+                    'body': json.dumps({'error': 'Invalid id or progress_percent'}),
+                    'isBase64Encoded': False
+                }
+            
+            if not isinstance(status, str) or not status:
+                return {
+                    'statusCode': 400,
+                    'headers': cors_headers,
+                    'body': json.dumps({'error': 'Invalid status'}),
+                    'isBase64Encoded': False
+                }
+            
             if progress_type not in ['course', 'trainer']:
                 return {
                     'statusCode': 400,
@@ -254,60 +565,32 @@ def handle_progress(method, user, body_data, headers, cors_headers, event):
             if status == 'completed':
                 progress_percent = 100
             
-            if progress_type == 'course':
-                if status == 'completed':
-                    cur.execute('''
-                        INSERT INTO t_p66738329_webapp_functionality.course_progress 
-                            (user_id, course_id, status, progress_percent, started_at, last_activity_at, completed_at)
-                        VALUES (%s, %s, %s, %s, NOW(), NOW(), NOW())
-                        ON CONFLICT (user_id, course_id) 
-                        DO UPDATE SET 
-                            status = EXCLUDED.status,
-                            progress_percent = EXCLUDED.progress_percent,
-                            last_activity_at = NOW(),
-                            completed_at = NOW()
-                        RETURNING *
-                    ''', (user['id'], item_id, status, progress_percent))
-                else:
-                    cur.execute('''
-                        INSERT INTO t_p66738329_webapp_functionality.course_progress 
-                            (user_id, course_id, status, progress_percent, started_at, last_activity_at)
-                        VALUES (%s, %s, %s, %s, NOW(), NOW())
-                        ON CONFLICT (user_id, course_id) 
-                        DO UPDATE SET 
-                            status = EXCLUDED.status,
-                            progress_percent = EXCLUDED.progress_percent,
-                            last_activity_at = NOW()
-                        RETURNING *
-                    ''', (user['id'], item_id, status, progress_percent))
-            else:
-                if status == 'completed':
-                    cur.execute('''
-                        INSERT INTO t_p66738329_webapp_functionality.trainer_progress 
-                            (user_id, trainer_id, status, progress_percent, started_at, last_activity_at, completed_at)
-                        VALUES (%s, %s, %s, %s, NOW(), NOW(), NOW())
-                        ON CONFLICT (user_id, trainer_id) 
-                        DO UPDATE SET 
-                            status = EXCLUDED.status,
-                            progress_percent = EXCLUDED.progress_percent,
-                            last_activity_at = NOW(),
-                            completed_at = NOW()
-                        RETURNING *
-                    ''', (user['id'], item_id, status, progress_percent))
-                else:
-                    cur.execute('''
-                        INSERT INTO t_p66738329_webapp_functionality.trainer_progress 
-                            (user_id, trainer_id, status, progress_percent, started_at, last_activity_at)
-                        VALUES (%s, %s, %s, %s, NOW(), NOW())
-                        ON CONFLICT (user_id, trainer_id) 
-                        DO UPDATE SET 
-                            status = EXCLUDED.status,
-                            progress_percent = EXCLUDED.progress_percent,
-                            last_activity_at = NOW()
-                        RETURNING *
-                    ''', (user['id'], item_id, status, progress_percent))
-            
-            progress_record = dict(cur.fetchone())
+            # Coalescing mode: a percentage within the current status only replaces the buffered one;
+            # completion, status changes and first writes go through to the progress table
+            if body_data.get('buffered') and status != 'completed':
+                staged = stage_progress(cur, progress_type, user['id'], item_id, status, progress_percent)
+                if staged:
+                    log_learning_events(cur, user['id'], [(progress_type, item_id, 'progress', status, progress_percent)])
+                    if time.time() - PROGRESS_FLUSH['at'] >= PROGRESS_FLUSH_SECONDS:
+                        PROGRESS_FLUSH['at'] = time.time()
+                        flush_progress_staging(cur)
+                    conn.commit()
+                    return {
+                        'statusCode': 200,
+                        'headers': cors_headers,
+                        'body': json.dumps(dict(staged, buffered=True), default=str),
+                        'isBase64Encoded': False
+                    }
+            
+            progress_record = upsert_progress(cur, progress_type, user['id'], item_id, status, progress_percent)
+            discard_staged_progress(cur, progress_type, user['id'], item_id)
+            log_learning_events(cur, user['id'], [(progress_type, item_id, 'completed' if status == 'completed' else 'progress', status, progress_percent)])
+            
+            # Recommendations depend on the completed set, so it gets a new version when that set changes
+            previous_status = progress_record.pop('previous_status')
+            if status == 'completed' or previous_status == 'completed':
+                bump_progress_version(cur, user['id'])
+            
             conn.commit()
             
             return {
@@ -334,11 +617,13 @@ def handle_progress(method, user, body_data, headers, cors_headers, event):
                 cur.execute('''
                     DELETE FROM t_p66738329_webapp_functionality.course_progress 
                     WHERE user_id = %s AND course_id = %s
+                    RETURNING status
                 ''', (user['id'], item_id))
             elif progress_type == 'trainer':
                 cur.execute('''
                     DELETE FROM t_p66738329_webapp_functionality.trainer_progress 
                     WHERE user_id = %s AND trainer_id = %s
+                    RETURNING status
                 ''', (user['id'], item_id))
             else:
                 return {
@@ -348,6 +633,13 @@ def handle_progress(method, user, body_data, headers, cors_headers, event):
                     'isBase64Encoded': False
                 }
             
+            deleted = cur.fetchone()
+            discard_staged_progress(cur, progress_type, user['id'], item_id)
+            if deleted:
+                log_learning_events(cur, user['id'], [(progress_type, item_id, 'reset', None, 0)])
+            if deleted and deleted['status'] == 'completed':
+                bump_progress_version(cur, user['id'])
+            
             conn.commit()
             
             return {
@@ -369,7 +661,7 @@ def handle_progress(method, user, body_data, headers, cors_headers, event):
         cur.close()
         conn.close()
 
-def handle_recommendations(method, user, body_data, headers, cors_headers, event):
+def handle_my_catalog(method, user, body_data, headers, cors_headers, event):
     if method != 'GET':
         return {
             'statusCode': 405,
@@ -382,236 +674,167 @@ def handle_recommendations(method, user, body_data, headers, cors_headers, event
     cur = conn.cursor()
     
     try:
-        # Get user's department_id
+        # Department, both versions and the user's own progress (with buffered percentages) in one round trip
         cur.execute('''
-            SELECT u.id, u.department_id
-            FROM t_p66738329_webapp_functionality.users u
+            SELECT u.department_id,
+                   (SELECT version FROM cache_versions WHERE scope = 'catalog') as catalog_version,
+                   (SELECT version FROM cache_versions WHERE scope = 'org') as org_version,
+                   COALESCE((
+                       SELECT json_object_agg(cp.course_id, json_build_object(
+                           'status', cp.status,
+                           'progress_percent', COALESCE(ps.progress_percent, cp.progress_percent),
+                           'completed_at', cp.completed_at))
+                       FROM course_progress cp
+                       LEFT JOIN progress_staging ps ON ps.user_id = cp.user_id AND ps.item_type = 'course' AND ps.item_id = cp.course_id AND ps.status = cp.status
+                       WHERE cp.user_id = u.id
+                   ), '{}') as course_progress,
+                   COALESCE((
+                       SELECT json_object_agg(tp.trainer_id, json_build_object(
+                           'status', tp.status,
+                           'progress_percent', COALESCE(ps.progress_percent, tp.progress_percent),
+                           'best_score', tp.best_score,
+                           'attempts_count', tp.attempts_count,
+                           'completed_at', tp.completed_at))
+                       FROM trainer_progress tp
+                       LEFT JOIN progress_staging ps ON ps.user_id = tp.user_id AND ps.item_type = 'trainer' AND ps.item_id = tp.trainer_id AND ps.status = tp.status
+                       WHERE tp.user_id = u.id
+                   ), '{}') as trainer_progress
+            FROM users u
             WHERE u.id = %s
         ''', (user['id'],))
-        user_data = cur.fetchone()
+        row = cur.fetchone()
+        department_id = row['department_id']
         
-        if not user_data:
-            return {
-                'statusCode': 404,
-                'headers': cors_headers,
-                'body': json.dumps({'error': 'User not found'}),
-                'isBase64Encoded': False
-            }
+        if department_id is None:
+            catalog = {'courses': [], 'trainers': []}
+        else:
+            cached = MY_CATALOG_CACHE.get(department_id)
+            if cached and cached[0] == row['catalog_version'] and cached[1] == row['org_version']:
+                catalog = cached[2]
+            else:
+                cur.execute('''
+                    SELECT
+                        COALESCE((
+                            SELECT json_agg(json_build_object('id', c.id, 'title', c.title, 'description', c.description,
+                                                              'duration_hours', c.duration_hours) ORDER BY c.title)
+                            FROM course_departments cd
+                            INNER JOIN courses c ON c.id = cd.course_id
+                            WHERE cd.department_id = %(department_id)s AND c.is_active = TRUE
+                        ), '[]') as courses,
+                        COALESCE((
+                            SELECT json_agg(json_build_object('id', t.id, 'title', t.title, 'description', t.description,
+                                                              'difficulty_level', t.difficulty_level) ORDER BY t.title)
+                            FROM trainer_departments td
+                            INNER JOIN trainers t ON t.id = td.trainer_id
+                            WHERE td.department_id = %(department_id)s AND t.is_active = TRUE
+                        ), '[]') as trainers
+                ''', {'department_id': department_id})
+                catalog = dict(cur.fetchone())
+                MY_CATALOG_CACHE[department_id] = (row['catalog_version'], row['org_version'], catalog)
+        
+        not_started = {'status': 'not_started', 'progress_percent': 0, 'completed_at': None}
+        courses = [dict(course, **row['course_progress'].get(str(course['id']), not_started)) for course in catalog['courses']]
+        trainers = [dict(trainer, **row['trainer_progress'].get(str(trainer['id']), dict(not_started, best_score=0, attempts_count=0)))
+                    for trainer in catalog['trainers']]
         
-        # Get completed courses
-        cur.execute('''
-            SELECT c.id, c.title, c.description, c.duration_hours
-            FROM t_p66738329_webapp_functionality.course_progress cp
-            INNER JOIN t_p66738329_webapp_functionality.courses c ON c.id = cp.course_id
-            WHERE cp.user_id = %s AND cp.status = 'completed'
-        ''', (user['id'],))
-        completed_courses = [dict(row) for row in cur.fetchall()]
+        return {
+            'statusCode': 200,
+            'headers': cors_headers,
+            'body': json.dumps({'department_id': department_id, 'courses': courses, 'trainers': trainers}, default=str),
+            'isBase64Encoded': False
+        }
+    
+    finally:
+        cur.close()
+        conn.close()
+
+def handle_recommendations(method, user, body_data, headers, cors_headers, event):
+    if method != 'GET':
+        return {
+            'statusCode': 405,
+            'headers': cors_headers,
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+    
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    try:
+        query_params = event.get('queryStringParameters', {}) or {}
+        mode = query_params.get('mode') if query_params.get('mode') in ['tfidf', 'lsh'] else 'index'
         
-        # Get completed trainers
+        # Versions and the stored result (if still current) in one round trip
         cur.execute('''
-            SELECT t.id, t.name, t.specialization, t.difficulty_level
-            FROM t_p66738329_webapp_functionality.trainer_progress tp
-            INNER JOIN t_p66738329_webapp_functionality.trainers t ON t.id = tp.trainer_id
-            WHERE tp.user_id = %s AND tp.status = 'completed'
-        ''', (user['id'],))
-        completed_trainers = [dict(row) for row in cur.fetchall()]
-        
-        # Get available courses (not completed)
-        completed_course_ids = [c['id'] for c in completed_courses]
-        if completed_course_ids:
-            placeholders = ','.join(['%s'] * len(completed_course_ids))
-            cur.execute(f'''
-                SELECT id, title, description, duration_hours, category
-                FROM t_p66738329_webapp_functionality.courses
-                WHERE id NOT IN ({placeholders}) AND is_active = true
-            ''', completed_course_ids)
+            SELECT cv.version as catalog_version, COALESCE(upv.version, 0) as progress_version, rc.result
+            FROM cache_versions cv
+            LEFT JOIN user_progress_versions upv ON upv.user_id = %(user_id)s
+            LEFT JOIN recommendation_cache rc ON rc.user_id = %(user_id)s AND rc.mode = %(mode)s
+                AND rc.catalog_version = cv.version AND rc.progress_version = COALESCE(upv.version, 0)
+            WHERE cv.scope = 'catalog'
+        ''', {'user_id': user['id'], 'mode': mode})
+        versions = cur.fetchone()
+        catalog_version = versions['catalog_version'] if versions else 0
+        progress_version = versions['progress_version'] if versions else 0
+        
+        cached = RECOMMENDATION_CACHE.get(user['id'], {}).get(mode)
+        if cached and cached[:2] == (catalog_version, progress_version):
+            body = cached[2]
+        elif versions and versions['result']:
+            body = versions['result']
         else:
+            # Token index is rebuilt only when the catalog version changes
+            index = recommender.get_catalog_index(cur, catalog_version)
+            
             cur.execute('''
-                SELECT id, title, description, duration_hours, category
-                FROM t_p66738329_webapp_functionality.courses
-                WHERE is_active = true
-            ''')
-        available_courses = [dict(row) for row in cur.fetchall()]
-        
-        # Get available trainers (not completed)
-        completed_trainer_ids = [t['id'] for t in completed_trainers]
-        if completed_trainer_ids:
-            placeholders = ','.join(['%s'] * len(completed_trainer_ids))
-            cur.execute(f'''
-                SELECT id, name, specialization, difficulty_level, bio
-                FROM t_p66738329_webapp_functionality.trainers
-                WHERE id NOT IN ({placeholders}) AND is_active = true
-            ''', completed_trainer_ids)
-        else:
+                SELECT course_id
+                FROM course_progress
+                WHERE user_id = %s AND status = 'completed'
+                ORDER BY completed_at, course_id
+            ''', (user['id'],))
+            completed_course_ids = [row['course_id'] for row in cur.fetchall()]
+            
             cur.execute('''
-                SELECT id, name, specialization, difficulty_level, bio
-                FROM t_p66738329_webapp_functionality.trainers
-                WHERE is_active = true
-            ''')
-        available_trainers = [dict(row) for row in cur.fetchall()]
-        
-        # Calculate recommendations
-        course_recommendations = []
-        trainer_recommendations = []
-        
-        if not completed_courses and not completed_trainers:
-            # Beginner-friendly recommendations
-            for course in available_courses:
-                score = 0
-                reasons = []
-                
-                if course.get('duration_hours', 999) <= 10:
-                    score += 5
-                    reasons.append('Short duration - beginner friendly')
-                
-                if 'beginner' in (course.get('title', '') + ' ' + course.get('description', '')).lower():
-                    score += 10
-                    reasons.append('Beginner level content')
-                
-                if 'introduction' in (course.get('title', '') + ' ' + course.get('description', '')).lower():
-                    score += 8
-                    reasons.append('Introductory course')
-                
-                course_recommendations.append({
-                    'id': course['id'],
-                    'title': course['title'],
-                    'description': course.get('description', ''),
-                    'duration_hours': course.get('duration_hours'),
-                    'score': score + 1,  # Base score for all
-                    'reasons': reasons if reasons else ['Great starting point']
-                })
-            
-            for trainer in available_trainers:
-                score = 0
-                reasons = []
-                
-                if trainer.get('difficulty_level', '').lower() in ['beginner', 'easy']:
-                    score += 10
-                    reasons.append('Beginner-friendly trainer')
-                
-                if 'introduction' in (trainer.get('name', '') + ' ' + trainer.get('specialization', '')).lower():
-                    score += 5
-                    reasons.append('Introductory training')
-                
-                trainer_recommendations.append({
-                    'id': trainer['id'],
-                    'name': trainer['name'],
-                    'specialization': trainer.get('specialization', ''),
-                    'difficulty_level': trainer.get('difficulty_level', ''),
-                    'score': score + 1,  # Base score for all
-                    'reasons': reasons if reasons else ['Recommended for new learners']
-                })
-        else:
-            # AI-based recommendations using similarity
-            for course in available_courses:
-                score = 0
-                reasons = []
-                course_text = (course.get('title', '') + ' ' + course.get('description', '')).lower()
-                
-                # Compare with completed courses
-                for completed_course in completed_courses:
-                    completed_text = (completed_course.get('title', '') + ' ' + completed_course.get('description', '')).lower()
-                    similarity = calculate_text_similarity(course_text, completed_text)
-                    if similarity > 0.1:
-                        score += 10 * similarity
-                        reasons.append(f'Similar to "{completed_course["title"]}"')
-                
-                # Compare with completed trainers
-                for completed_trainer in completed_trainers:
-                    trainer_text = (completed_trainer.get('name', '') + ' ' + completed_trainer.get('specialization', '')).lower()
-                    similarity = calculate_text_similarity(course_text, trainer_text)
-                    if similarity > 0.1:
-                        score += 5 * similarity
-                        reasons.append(f'Matches trainer: {completed_trainer["name"]}')
-                
-                # Bonus for short duration
-                if course.get('duration_hours', 999) <= 20:
-                    score += 2
-                    reasons.append('Manageable duration')
-                
-                if score > 0:
-                    course_recommendations.append({
-                        'id': course['id'],
-                        'title': course['title'],
-                        'description': course.get('description', ''),
-                        'duration_hours': course.get('duration_hours'),
-                        'score': round(score, 2),
-                        'reasons': reasons[:3]  # Top 3 reasons
-                    })
-            
-            for trainer in available_trainers:
-                score = 0
-                reasons = []
-                trainer_text = (trainer.get('name', '') + ' ' + trainer.get('specialization', '')).lower()
-                
-                # Compare with completed trainers
-                for completed_trainer in completed_trainers:
-                    completed_text = (completed_trainer.get('name', '') + ' ' + completed_trainer.get('specialization', '')).lower()
-                    similarity = calculate_text_similarity(trainer_text, completed_text)
-                    if similarity > 0.1:
-                        score += 10 * similarity
-                        reasons.append(f'Similar to "{completed_trainer["name"]}"')
-                
-                # Compare with completed courses
-                for completed_course in completed_courses:
-                    course_text = (completed_course.get('title', '') + ' ' + completed_course.get('description', '')).lower()
-                    similarity = calculate_text_similarity(trainer_text, course_text)
-                    if similarity > 0.1:
-                        score += 8 * similarity
-                        reasons.append(f'Matches course: {completed_course["title"]}')
-                
-                # Bonus for matching difficulty level
-                if completed_trainers:
-                    most_common_level = completed_trainers[-1].get('difficulty_level', '')
-                    if trainer.get('difficulty_level', '') == most_common_level:
-                        score += 3
-                        reasons.append(f'Matches your level: {most_common_level}')
-                
-                if score > 0:
-                    trainer_recommendations.append({
-                        'id': trainer['id'],
-                        'name': trainer['name'],
-                        'specialization': trainer.get('specialization', ''),
-                        'difficulty_level': trainer.get('difficulty_level', ''),
-                        'score': round(score, 2),
-                        'reasons': reasons[:3]  # Top 3 reasons
-                    })
-        
-        # Sort by score and get top 5
-        course_recommendations.sort(key=lambda x: x['score'], reverse=True)
-        trainer_recommendations.sort(key=lambda x: x['score'], reverse=True)
-        
-        top_courses = course_recommendations[:5]
-        top_trainers = trainer_recommendations[:5]
-        
-        result = {
-            'courses': top_courses,
-            'trainers': top_trainers,
-            'stats': {
-                'completed_courses': len(completed_courses),
-                'completed_trainers': len(completed_trainers)
-            }
-        }
+                SELECT trainer_id
+                FROM trainer_progress
+                WHERE user_id = %s AND status = 'completed'
+                ORDER BY completed_at, trainer_id
+            ''', (user['id'],))
+            completed_trainer_ids = [row['trainer_id'] for row in cur.fetchall()]
+            
+            if mode == 'tfidf':
+                result = recommender.recommend_tfidf(index, completed_course_ids, completed_trainer_ids)
+            elif mode == 'lsh':
+                result = recommender.recommend_lsh(cur, index, completed_course_ids, completed_trainer_ids)
+            else:
+                result = recommender.recommend(index, completed_course_ids, completed_trainer_ids)
+            body = recommender.json_body(result)
+            
+            cur.execute('''
+                INSERT INTO recommendation_cache (user_id, mode, catalog_version, progress_version, result, computed_at)
+                VALUES (%s, %s, %s, %s, %s, NOW())
+                ON CONFLICT (user_id, mode) DO UPDATE SET
+                    catalog_version = EXCLUDED.catalog_version,
+                    progress_version = EXCLUDED.progress_version,
+                    result = EXCLUDED.result,
+                    computed_at = EXCLUDED.computed_at
+            ''', (user['id'], mode, catalog_version, progress_version, body))
+            conn.commit()
         
-        cur.close()
-        conn.close()
+        if len(RECOMMENDATION_CACHE) >= RECOMMENDATION_CACHE_LIMIT:
+            RECOMMENDATION_CACHE.clear()
+        RECOMMENDATION_CACHE.setdefault(user['id'], {})[mode] = (catalog_version, progress_version, body)
         
         return {
             'statusCode': 200,
             'headers': cors_headers,
-            'body': json.dumps(result, default=str),
+            'body': body,
             'isBase64Encoded': False
         }
     
-    except Exception as e:
+    finally:
         cur.close()
         conn.close()
-        return {
-            'statusCode': 500,
-            'headers': cors_headers,
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
 
 def handle_companies(method, user, body_data, headers, cors_headers, event):
     if method == 'GET':
@@ -943,6 +1166,590 @@ def handle_departments(method, user, body_data, headers, cors_headers, event):
             'isBase64Encoded': False
         }
 
+def handle_org_tree(method, user, body_data, headers, cors_headers, event):
+    if method != 'GET':
+        return {
+            'statusCode': 405,
+            'headers': cors_headers,
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+    
+    if not has_permission(user['id'], 'companies.view') or not has_permission(user['id'], 'departments.view'):
+        return {
+            'statusCode': 403,
+            'headers': cors_headers,
+            'body': json.dumps({'error': 'Permission denied'}),
+            'isBase64Encoded': False
+        }
+    
+    query_params = event.get('queryStringParameters', {}) or {}
+    try:
+        company_id = int(query_params['company_id']) if query_params.get('company_id') else None
+    except ValueError:
+        company_id = 0
+    if company_id is not None and company_id < 1:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers,
+            'body': json.dumps({'error': 'company_id must be a positive integer'}),
+            'isBase64Encoded': False
+        }
+    
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    try:
+        # The version is read before the tree, so a cached body is never older than its stamp
+        version = get_cache_version(cur, 'org')
+        etag = f'"org-{company_id or 0}-{version}"'
+        response_headers = {**cors_headers, 'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        
+        if headers.get('If-None-Match', headers.get('if-none-match')) == etag:
+            return {
+                'statusCode': 304,
+                'headers': response_headers,
+                'body': '',
+                'isBase64Encoded': False
+            }
+        
+        cached = ORG_TREE_CACHE.get(company_id)
+        if cached and cached[0] == version:
+            return {
+                'statusCode': 200,
+                'headers': response_headers,
+                'body': cached[1],
+                'isBase64Encoded': False
+            }
+        
+        # Counts are pre-aggregated per department before the join, so no COUNT DISTINCT fan-out
+        cur.execute('''
+            WITH scoped_departments AS (
+                SELECT d.* FROM departments d
+                WHERE %(company_id)s::int IS NULL OR d.company_id = %(company_id)s::int
+            ),
+            department_users AS (
+                SELECT u.department_id, COUNT(*) as users_count
+                FROM users u
+                INNER JOIN scoped_departments sd ON sd.id = u.department_id
+                GROUP BY u.department_id
+            ),
+            department_courses AS (
+                SELECT cd.department_id, COUNT(*) as courses_count
+                FROM course_departments cd
+                INNER JOIN scoped_departments sd ON sd.id = cd.department_id
+                GROUP BY cd.department_id
+            ),
+            department_trainers AS (
+                SELECT td.department_id, COUNT(*) as trainers_count
+                FROM trainer_departments td
+                INNER JOIN scoped_departments sd ON sd.id = td.department_id
+                GROUP BY td.department_id
+            ),
+            company_users AS (
+                SELECT u.company_id, COUNT(*) as users_count
+                FROM users u
+                WHERE u.company_id IS NOT NULL
+                  AND (%(company_id)s::int IS NULL OR u.company_id = %(company_id)s::int)
+                GROUP BY u.company_id
+            ),
+            company_departments AS (
+                SELECT sd.company_id,
+                       json_agg(json_build_object(
+                           'id', sd.id,
+                           'name', sd.name,
+                           'description', sd.description,
+                           'is_active', sd.is_active,
+                           'access_group_id', sd.access_group_id,
+                           'access_group_name', ag.group_name,
+                           'users_count', COALESCE(du.users_count, 0),
+                           'courses_count', COALESCE(dc.courses_count, 0),
+                           'trainers_count', COALESCE(dt.trainers_count, 0)
+                       ) ORDER BY sd.name) as departments
+                FROM scoped_departments sd
+                LEFT JOIN access_groups ag ON ag.id = sd.access_group_id
+                LEFT JOIN department_users du ON du.department_id = sd.id
+                LEFT JOIN department_courses dc ON dc.department_id = sd.id
+                LEFT JOIN department_trainers dt ON dt.department_id = sd.id
+                GROUP BY sd.company_id
+            )
+            SELECT json_build_object(
+                'version', %(version)s::bigint,
+                'companies', COALESCE(json_agg(json_build_object(
+                    'id', c.id,
+                    'name', c.name,
+                    'description', c.description,
+                    'is_active', c.is_active,
+                    'users_count', COALESCE(cu.users_count, 0),
+                    'departments_count', COALESCE(json_array_length(cdep.departments), 0),
+                    'departments', COALESCE(cdep.departments, '[]'::json)
+                ) ORDER BY c.name), '[]'::json)
+            )::text as body
+            FROM companies c
+            LEFT JOIN company_users cu ON cu.company_id = c.id
+            LEFT JOIN company_departments cdep ON cdep.company_id = c.id
+            WHERE %(company_id)s::int IS NULL OR c.id = %(company_id)s::int
+        ''', {'company_id': company_id, 'version': version})
+        
+        body = cur.fetchone()['body']
+        ORG_TREE_CACHE[company_id] = (version, body)
+        
+        return {
+            'statusCode': 200,
+            'headers': response_headers,
+            'body': body,
+            'isBase64Encoded': False
+        }
+    
+    finally:
+        cur.close()
+        conn.close()
+
+def sync_departments(cur, link_table: str, item_column: str, item_id: int, department_ids, replace: bool = True):
+    """Bring item's department links to exactly department_ids (or just add them) with set-based statements"""
+    department_ids = [int(d) for d in department_ids]
+    if replace:
+        cur.execute(f'DELETE FROM {link_table} WHERE {item_column} = %s AND department_id <> ALL(%s::int[])', (item_id, department_ids))
+    if department_ids:
+        cur.execute(f'INSERT INTO {link_table} ({item_column}, department_id) SELECT %s, unnest(%s::int[]) ON CONFLICT DO NOTHING', (item_id, department_ids))
+
+def assign_to_departments(cur, link_table: str, item_column: str, item_ids, department_ids) -> int:
+    """Link every item to every department in one statement, returns number of new links"""
+    cur.execute(f'''
+        INSERT INTO {link_table} ({item_column}, department_id)
+        SELECT i, d FROM unnest(%s::int[]) AS i CROSS JOIN unnest(%s::int[]) AS d
+        ON CONFLICT DO NOTHING
+    ''', ([int(i) for i in item_ids], [int(d) for d in department_ids]))
+    return cur.rowcount
+
+def int_list(value) -> List[int]:
+    """Integers of a JSON list from a request body; raises ValueError or TypeError for anything else"""
+    if not isinstance(value, list):
+        raise ValueError('expected a list')
+    return [int(v) for v in value]
+
+def bulk_assign_departments(user, body_data, cors_headers, permission_code, link_table, item_column, items_key):
+    if not has_permission(user['id'], permission_code):
+        return {'statusCode': 403, 'headers': cors_headers, 'body': json.dumps({'error': 'Permission denied'}), 'isBase64Encoded': False}
+    try:
+        item_ids = int_list(body_data.get(items_key) or [])
+        department_ids = int_list(body_data.get('department_ids') or [])
+    except (TypeError, ValueError):
+        item_ids, department_ids = [], []
+    if not item_ids or not department_ids:
+        return {'statusCode': 400, 'headers': cors_headers, 'body': json.dumps({'error': f'{items_key} and department_ids required as lists of integers'}), 'isBase64Encoded': False}
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        assigned = assign_to_departments(cur, link_table, item_column, item_ids, department_ids)
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    return {'statusCode': 200, 'headers': cors_headers, 'body': json.dumps({'assigned': assigned}), 'isBase64Encoded': False}
+
+# Users seeded with not_started progress per statement when a course is assigned to departments
+PROGRESS_SEED_BATCH = 5000
+
+def seed_course_progress(conn, cur, course_id: int, department_ids) -> int:
+    """Create not_started progress rows for all users of the departments, committing after each batch of users"""
+    created = 0
+    last_user_id = 0
+    while True:
+        cur.execute('''
+            WITH batch AS (
+                SELECT id FROM users
+                WHERE department_id = ANY(%s::int[]) AND id > %s
+                ORDER BY id
+                LIMIT %s
+            ),
+            seeded AS (
+                INSERT INTO course_progress (user_id, course_id, status, progress_percent)
+                SELECT id, %s, 'not_started', 0 FROM batch
+                ON CONFLICT (user_id, course_id) DO NOTHING
+                RETURNING 1
+            )
+            SELECT (SELECT MAX(id) FROM batch) as last_user_id, (SELECT COUNT(*) FROM seeded) as seeded
+        ''', (department_ids, last_user_id, PROGRESS_SEED_BATCH, course_id))
+        row = cur.fetchone()
+        conn.commit()
+        if row['last_user_id'] is None:
+            return created
+        created += row['seeded']
+        last_user_id = row['last_user_id']
+
+def assign_course_with_deadline(user, body_data, cors_headers):
+    if not has_permission(user['id'], 'courses.edit'):
+        return {'statusCode': 403, 'headers': cors_headers, 'body': json.dumps({'error': 'Permission denied'}), 'isBase64Encoded': False}
+    try:
+        course_id = int(body_data.get('course_id'))
+        department_ids = int_list(body_data.get('department_ids') or [])
+        deadline = date.fromisoformat(body_data['deadline']) if body_data.get('deadline') else None
+    except (TypeError, ValueError):
+        course_id, department_ids = None, []
+    if not course_id or not department_ids:
+        return {'statusCode': 400, 'headers': cors_headers, 'body': json.dumps({'error': 'Integer course_id, a list of integer department_ids and an optional YYYY-MM-DD deadline required'}), 'isBase64Encoded': False}
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute('''
+            INSERT INTO course_departments (course_id, department_id, deadline)
+            SELECT c.id, d, %s::date FROM courses c CROSS JOIN unnest(%s::int[]) AS d
+            WHERE c.id = %s
+            ON CONFLICT (course_id, department_id) DO UPDATE SET deadline = EXCLUDED.deadline
+        ''', (deadline, department_ids, course_id))
+        if cur.rowcount == 0:
+            return {'statusCode': 404, 'headers': cors_headers, 'body': json.dumps({'error': 'Not found'}), 'isBase64Encoded': False}
+        conn.commit()
+        seeded = seed_course_progress(conn, cur, course_id, department_ids)
+    finally:
+        cur.close()
+        conn.close()
+    return {'statusCode': 200, 'headers': cors_headers, 'body': json.dumps({'course_id': course_id, 'departments': len(department_ids), 'deadline': deadline.isoformat() if deadline else None, 'progress_created': seeded}), 'isBase64Encoded': False}
+
+def split_content(content: str):
+    """Split content into sections at markdown headings and sections into chunks of at most CONTENT_CHUNK_BYTES"""
+    sections = []
+    for line in content.splitlines(keepends=True):
+        is_heading = line.startswith('#')
+        if not sections or (is_heading and sections[-1][1]):
+            sections.append([line.strip().lstrip('#').strip()[:255] if is_heading else None, []])
+        sections[-1][1].append(line)
+    
+    chunks = []
+    
+    def add_chunk(section_no, section_title, body):
+        previous = chunks[-1] if chunks else None
+        chunks.append({
+            'chunk_no': len(chunks),
+            'section_no': section_no,
+            'section_title': section_title,
+            'byte_offset': previous['byte_offset'] + previous['byte_length'] if previous else 0,
+            'byte_length': len(body.encode('utf-8')),
+            'chunk_hash': hashlib.sha256(body.encode('utf-8')).hexdigest(),
+            'body': body
+        })
+    
+    for section_no, (section_title, lines) in enumerate(sections):
+        pieces = []
+        for line in lines:
+            if len(line.encode('utf-8')) <= CONTENT_CHUNK_BYTES:
+                pieces.append(line)
+            else:
+                # A UTF-8 character takes at most 4 bytes
+                step = CONTENT_CHUNK_BYTES // 4
+                pieces.extend(line[i:i + step] for i in range(0, len(line), step))
+        
+        buffer, buffer_bytes = [], 0
+        for piece in pieces:
+            piece_bytes = len(piece.encode('utf-8'))
+            if buffer and buffer_bytes + piece_bytes > CONTENT_CHUNK_BYTES:
+                add_chunk(section_no, section_title, ''.join(buffer))
+                buffer, buffer_bytes = [], 0
+            buffer.append(piece)
+            buffer_bytes += piece_bytes
+        if buffer:
+            add_chunk(section_no, section_title, ''.join(buffer))
+    
+    return chunks
+
+def catalog_terms(title: str, description) -> str:
+    """Normalized terms of a course/trainer as stored in its terms column"""
+    return json.dumps(tokenizer.term_counts(title + ' ' + (description or '')), ensure_ascii=False)
+
+def write_content(cur, item_type: str, item_id: int, content, current_hash=None):
+    """Store content as chunks, rewriting only chunks whose hash changed. Returns new hash and length, or None if unchanged"""
+    content = content or ''
+    content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    if content_hash == current_hash:
+        return None
+    
+    chunks = split_content(content)
+    
+    cur.execute('''
+        SELECT chunk_no, chunk_hash, section_no, section_title, byte_offset
+        FROM content_chunks
+        WHERE item_type = %s AND item_id = %s
+    ''', (item_type, item_id))
+    existing = {row['chunk_no']: row for row in cur.fetchall()}
+    
+    # Chunks are matched by hash, so a body that only shifted position is reused instead of rewritten
+    by_hash = {}
+    for old in existing.values():
+        by_hash.setdefault(old['chunk_hash'], []).append(old['chunk_no'])
+    for numbers in by_hash.values():
+        numbers.sort(reverse=True)
+    
+    reused = {}
+    changed = []
+    for chunk in chunks:
+        numbers = by_hash.get(chunk['chunk_hash'])
+        if not numbers:
+            changed.append(chunk)
+            continue
+        old_no = chunk['chunk_no'] if chunk['chunk_no'] in numbers else numbers[-1]
+        numbers.remove(old_no)
+        reused[old_no] = chunk
+    
+    moved = [(old_no, chunk) for old_no, chunk in reused.items()
+             if (old_no, existing[old_no]['section_no'], existing[old_no]['section_title'], existing[old_no]['byte_offset'])
+             != (chunk['chunk_no'], chunk['section_no'], chunk['section_title'], chunk['byte_offset'])]
+    
+    cur.execute('DELETE FROM content_chunks WHERE item_type = %s AND item_id = %s AND chunk_no <> ALL(%s::int[])',
+                (item_type, item_id, list(reused)))
+    
+    # Reused rows get a metadata-only update; numbers pass through negative values so renumbering never collides
+    if moved:
+        execute_values(cur, '''
+            UPDATE content_chunks cc
+            SET chunk_no = -1 - v.chunk_no, section_no = v.section_no, section_title = v.section_title, byte_offset = v.byte_offset
+            FROM (VALUES %s) AS v(item_type, item_id, old_no, chunk_no, section_no, section_title, byte_offset)
+            WHERE cc.item_type = v.item_type AND cc.item_id = v.item_id AND cc.chunk_no = v.old_no
+        ''', [(item_type, item_id, old_no, c['chunk_no'], c['section_no'], c['section_title'], c['byte_offset']) for old_no, c in moved],
+            template='(%s, %s, %s, %s, %s, %s::varchar, %s)')
+        cur.execute('UPDATE content_chunks SET chunk_no = -1 - chunk_no WHERE item_type = %s AND item_id = %s AND chunk_no < 0',
+                    (item_type, item_id))
+    
+    if changed:
+        execute_values(cur, '''
+            INSERT INTO content_chunks
+            (item_type, item_id, chunk_no, section_no, section_title, byte_offset, byte_length, chunk_hash, body)
+            VALUES %s
+        ''', [(item_type, item_id, c['chunk_no'], c['section_no'], c['section_title'], c['byte_offset'],
+               c['byte_length'], c['chunk_hash'], c['body']) for c in changed])
+    
+    content_length = chunks[-1]['byte_offset'] + chunks[-1]['byte_length'] if chunks else 0
+    cur.execute(f"UPDATE {CONTENT_ITEM_TABLES[item_type]} SET content_hash = %s, content_length = %s, content_vector = to_tsvector('russian', %s) WHERE id = %s",
+                (content_hash, content_length, content[:CONTENT_SEARCH_CHARS], item_id))
+    
+    return {'content_hash': content_hash, 'content_length': content_length}
+
+def parse_page(query_params: Dict, default_limit: int, max_limit: int, cursor_types) -> tuple:
+    """limit and the '|'-separated cursor values of a keyset page request (None values without a cursor);
+    raises ValueError unless 1 <= limit <= max_limit and the cursor has one valid value per type"""
+    limit = int(query_params.get('limit') or default_limit)
+    if not 1 <= limit <= max_limit:
+        raise ValueError(f'limit must be between 1 and {max_limit}')
+    if not query_params.get('cursor'):
+        return limit, tuple(None for _ in cursor_types)
+    values = query_params['cursor'].split('|')
+    if len(values) != len(cursor_types):
+        raise ValueError('malformed cursor')
+    return limit, tuple(parse(value) for parse, value in zip(cursor_types, values))
+
+def list_catalog(cur, table: str, link_table: str, item_column: str, columns: str, query_params: Dict):
+    """Newest-first page of courses/trainers with filters; cursor is 'created_at|id' of the last row of the previous page.
+    Raises ValueError on a malformed limit, cursor or department_id"""
+    limit, (after_created, after_id) = parse_page(query_params, LIST_PAGE_SIZE, LIST_PAGE_SIZE_MAX, (datetime.fromisoformat, int))
+    department_id = int(query_params['department_id']) if query_params.get('department_id') else None
+    is_active = {'true': True, 'false': False}.get(query_params.get('is_active'))
+    # Only trainers have a difficulty level
+    difficulty_filter = 'AND (%(difficulty_level)s::varchar IS NULL OR i.difficulty_level = %(difficulty_level)s::varchar)' if table == 'trainers' else ''
+    
+    cur.execute(f'''
+        SELECT {columns}, u.full_name as creator_name, i.departments_count
+        FROM {table} i
+        LEFT JOIN users u ON u.id = i.created_by
+        WHERE (%(is_active)s::boolean IS NULL OR i.is_active = %(is_active)s::boolean)
+          {difficulty_filter}
+          AND (%(department_id)s::int IS NULL OR EXISTS (
+              SELECT 1 FROM {link_table} l WHERE l.{item_column} = i.id AND l.department_id = %(department_id)s::int
+          ))
+          AND (%(after_created)s::timestamp IS NULL OR (i.created_at, i.id) < (%(after_created)s::timestamp, %(after_id)s::int))
+        ORDER BY i.created_at DESC, i.id DESC
+        LIMIT %(limit)s
+    ''', {
+        'is_active': is_active,
+        'difficulty_level': query_params.get('difficulty_level'),
+        'department_id': department_id,
+        'after_created': after_created,
+        'after_id': after_id,
+        'limit': limit + 1
+    })
+    rows = [dict(r) for r in cur.fetchall()]
+    
+    next_cursor = f"{rows[limit - 1]['created_at'].isoformat()}|{rows[limit - 1]['id']}" if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def html_escape(expression: str) -> str:
+    """SQL expression escaping the HTML special characters of a text expression"""
+    for char, entity in (('&', '&amp;'), ('<', '&lt;'), ('>', '&gt;'), ('"', '&quot;'), ("'", '&#39;')):
+        expression = f"replace({expression}, '{char.replace(chr(39), chr(39) * 2)}', '{entity}')"
+    return expression
+
+def search_catalog(cur, table: str, columns: str, query_params: Dict):
+    """Full-text search ranked by ts_rank with keyset pagination; cursor is 'rank|id' of the last row of the previous page.
+    title_highlight and snippet are HTML-safe: the source text is escaped before <mark> tags are added.
+    Raises ValueError on a malformed limit or cursor"""
+    limit, (after_rank, after_id) = parse_page(query_params, SEARCH_PAGE_SIZE, SEARCH_PAGE_SIZE_MAX, (float, int))
+    
+    # Headlines are built only for the page, after ranking and the limit
+    cur.execute(f'''
+        WITH search AS (
+            SELECT websearch_to_tsquery('russian', %(q)s) as query
+        ),
+        page AS (
+            SELECT i.id, ts_rank(i.search_vector, s.query) as rank
+            FROM {table} i, search s
+            WHERE i.search_vector @@ s.query
+              AND (%(after_rank)s::real IS NULL OR (ts_rank(i.search_vector, s.query), i.id) < (%(after_rank)s::real, %(after_id)s::int))
+            ORDER BY rank DESC, i.id DESC
+            LIMIT %(limit)s
+        )
+        SELECT {columns}, p.rank,
+               ts_headline('russian', {html_escape('i.title')}, s.query, 'StartSel=<mark>, StopSel=</mark>, HighlightAll=true') as title_highlight,
+               ts_headline('russian', {html_escape("COALESCE(i.description, '')")}, s.query, 'StartSel=<mark>, StopSel=</mark>, MaxWords=35, MinWords=15') as snippet
+        FROM page p
+        INNER JOIN {table} i ON i.id = p.id
+        CROSS JOIN search s
+        ORDER BY p.rank DESC, p.id DESC
+    ''', {'q': query_params['q'], 'after_rank': after_rank, 'after_id': after_id, 'limit': limit + 1})
+    rows = [dict(r) for r in cur.fetchall()]
+    
+    next_cursor = f"{rows[limit - 1]['rank']}|{rows[limit - 1]['id']}" if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def handle_content(method, user, body_data, headers, cors_headers, event):
+    if method != 'GET':
+        return {'statusCode': 405, 'headers': cors_headers, 'body': json.dumps({'error': 'Method not allowed'}), 'isBase64Encoded': False}
+    
+    query_params = event.get('queryStringParameters', {}) or {}
+    item_type = query_params.get('type')
+    item_id = query_params.get('id')
+    
+    if item_type not in CONTENT_ITEM_TABLES or not item_id:
+        return {'statusCode': 400, 'headers': cors_headers, 'body': json.dumps({'error': 'type (course or trainer) and id required'}), 'isBase64Encoded': False}
+    
+    if not has_permission(user['id'], f'{item_type}s.view'):
+        return {'statusCode': 403, 'headers': cors_headers, 'body': json.dumps({'error': 'Permission denied'}), 'isBase64Encoded': False}
+    
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    try:
+        cur.execute(f'SELECT id, content_hash, content_length FROM {CONTENT_ITEM_TABLES[item_type]} WHERE id = %s', (item_id,))
+        item = cur.fetchone()
+        if not item:
+            return {'statusCode': 404, 'headers': cors_headers, 'body': json.dumps({'error': 'Not found'}), 'isBase64Encoded': False}
+        
+        result = {'type': item_type, 'id': item['id'], 'content_hash': item['content_hash'], 'content_length': item['content_length']}
+        
+        if query_params.get('section') is not None:
+            cur.execute('''
+                SELECT section_no, MIN(section_title) as title, MIN(byte_offset) as byte_offset,
+                       SUM(byte_length)::int as byte_length, string_agg(body, '' ORDER BY chunk_no) as content
+                FROM content_chunks
+                WHERE item_type = %s AND item_id = %s AND section_no = %s
+                GROUP BY section_no
+            ''', (item_type, item['id'], int(query_params['section'])))
+            section = cur.fetchone()
+            if not section:
+                return {'statusCode': 404, 'headers': cors_headers, 'body': json.dumps({'error': 'Section not found'}), 'isBase64Encoded': False}
+            result['section'] = dict(section)
+        
+        elif query_params.get('offset') is not None:
+            start = max(int(query_params['offset']), 0)
+            end = start + int(query_params['length']) if query_params.get('length') else item['content_length']
+            end = min(end, item['content_length'])
+            
+            cur.execute('''
+                SELECT byte_offset, body
+                FROM content_chunks
+                WHERE item_type = %s AND item_id = %s
+                  AND byte_offset < %s AND byte_offset + byte_length > %s
+                ORDER BY chunk_no
+            ''', (item_type, item['id'], end, start))
+            rows = cur.fetchall()
+            
+            data = ''.join(row['body'] for row in rows).encode('utf-8')
+            base = rows[0]['byte_offset'] if rows else start
+            # Characters cut by the range boundaries are dropped rather than returned half-encoded
+            result['range'] = {
+                'offset': start,
+                'length': max(end - start, 0),
+                'content': data[start - base:end - base].decode('utf-8', errors='ignore')
+            }
+        
+        else:
+            cur.execute('''
+                SELECT section_no, MIN(section_title) as title, MIN(byte_offset) as byte_offset, SUM(byte_length)::int as byte_length
+                FROM content_chunks
+                WHERE item_type = %s AND item_id = %s
+                GROUP BY section_no
+                ORDER BY section_no
+            ''', (item_type, item['id']))
+            result['sections'] = [dict(row) for row in cur.fetchall()]
+        
+        return {'statusCode': 200, 'headers': cors_headers, 'body': json.dumps(result), 'isBase64Encoded': False}
+    
+    finally:
+        cur.close()
+        conn.close()
+
+def handle_report(method, user, body_data, headers, cors_headers, event):
+    if method != 'GET':
+        return {
+            'statusCode': 405,
+            'headers': cors_headers,
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+    
+    if not has_permission(user['id'], 'reports.view'):
+        return {
+            'statusCode': 403,
+            'headers': cors_headers,
+            'body': json.dumps({'error': 'Permission denied'}),
+            'isBase64Encoded': False
+        }
+    
+    query_params = event.get('queryStringParameters', {}) or {}
+    if query_params.get('department_id'):
+        table, column, scope_id = 'department_course_rollups', 'department_id', int(query_params['department_id'])
+    elif query_params.get('company_id'):
+        table, column, scope_id = 'company_course_rollups', 'company_id', int(query_params['company_id'])
+    else:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers,
+            'body': json.dumps({'error': 'company_id or department_id required'}),
+            'isBase64Encoded': False
+        }
+    course_id = int(query_params['course_id']) if query_params.get('course_id') else None
+    
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    try:
+        # Rollups are kept current by triggers on progress, assignments and users, so this is a primary-key range read
+        cur.execute(f'''
+            SELECT json_build_object('report', COALESCE(json_agg(json_build_object(
+                'course_id', r.course_id,
+                'course_title', c.title,
+                'assigned', r.assigned,
+                'started', r.started,
+                'completed', r.completed,
+                'completion_rate', CASE WHEN r.assigned > 0 THEN ROUND(100.0 * r.completed / r.assigned, 1) ELSE 0 END,
+                'avg_percent', CASE WHEN r.started > 0 THEN ROUND(r.percent_sum::numeric / r.started, 1) ELSE 0 END,
+                'updated_at', r.updated_at
+            ) ORDER BY c.title), '[]'))::text as body
+            FROM {table} r
+            INNER JOIN courses c ON c.id = r.course_id
+            WHERE r.{column} = %s AND (%s::int IS NULL OR r.course_id = %s::int)
+        ''', (scope_id, course_id, course_id))
+        body = cur.fetchone()['body']
+        
+        return {
+            'statusCode': 200,
+            'headers': cors_headers,
+            'body': body,
+            'isBase64Encoded': False
+        }
+    
+    finally:
+        cur.close()
+        conn.close()
+
 def handle_courses(method, user, body_data, headers, cors_headers, event):
     if method == 'GET':
         if not has_permission(user['id'], 'courses.view'):
@@ -954,26 +1761,52 @@ def handle_courses(method, user, body_data, headers, cors_headers, event):
         cur = conn.cursor()
         
         if course_id:
-            cur.execute('SELECT c.*, u.full_name as creator_name FROM courses c LEFT JOIN users u ON u.id = c.created_by WHERE c.id = %s', (course_id,))
+            cur.execute('''
+                SELECT json_build_object('course', to_jsonb(c) - 'terms' - 'content_vector' - 'search_vector' || jsonb_build_object(
+                    'creator_name', u.full_name,
+                    'departments', COALESCE((
+                        SELECT jsonb_agg(jsonb_build_object('id', d.id, 'name', d.name, 'company_name', co.name))
+                        FROM course_departments cd
+                        INNER JOIN departments d ON d.id = cd.department_id
+                        INNER JOIN companies co ON co.id = d.company_id
+                        WHERE cd.course_id = c.id
+                    ), '[]'::jsonb)
+                ))::text as body
+                FROM courses c
+                LEFT JOIN users u ON u.id = c.created_by
+                WHERE c.id = %s
+            ''', (course_id,))
             course = cur.fetchone()
+            cur.close()
+            conn.close()
             if not course:
+                return {'statusCode': 404, 'headers': cors_headers, 'body': json.dumps({'error': 'Not found'}), 'isBase64Encoded': False}
+            return {'statusCode': 200, 'headers': cors_headers, 'body': course['body'], 'isBase64Encoded': False}
+        
+        if query_params.get('q'):
+            try:
+                courses, next_cursor = search_catalog(cur, 'courses', 'i.id, i.title, i.description, i.duration_hours, i.is_active, i.created_at', query_params)
+            except ValueError:
+                return {'statusCode': 400, 'headers': cors_headers, 'body': json.dumps({'error': f'limit must be 1-{SEARCH_PAGE_SIZE_MAX} and cursor rank|id'}), 'isBase64Encoded': False}
+            finally:
                 cur.close()
                 conn.close()
-                return {'statusCode': 404, 'headers': cors_headers, 'body': json.dumps({'error': 'Not found'}), 'isBase64Encoded': False}
-            course = dict(course)
-            cur.execute('SELECT d.id, d.name, c.name as company_name FROM course_departments cd INNER JOIN departments d ON d.id = cd.department_id INNER JOIN companies c ON c.id = d.company_id WHERE cd.course_id = %s', (course_id,))
-            course['departments'] = [dict(r) for r in cur.fetchall()]
+            return {'statusCode': 200, 'headers': cors_headers, 'body': json.dumps({'courses': courses, 'next_cursor': next_cursor}, default=str), 'isBase64Encoded': False}
+        
+        try:
+            courses, next_cursor = list_catalog(cur, 'courses', 'course_departments', 'course_id', 'i.id, i.title, i.description, i.duration_hours, i.is_active, i.created_at', query_params)
+        except ValueError:
+            return {'statusCode': 400, 'headers': cors_headers, 'body': json.dumps({'error': f'limit must be 1-{LIST_PAGE_SIZE_MAX}, cursor created_at|id and department_id an integer'}), 'isBase64Encoded': False}
+        finally:
             cur.close()
             conn.close()
-            return {'statusCode': 200, 'headers': cors_headers, 'body': json.dumps({'course': course}, default=str), 'isBase64Encoded': False}
-        
-        cur.execute('SELECT c.id, c.title, c.description, c.duration_hours, c.is_active, c.created_at, u.full_name as creator_name, COUNT(DISTINCT cd.department_id) as departments_count FROM courses c LEFT JOIN users u ON u.id = c.created_by LEFT JOIN course_departments cd ON cd.course_id = c.id GROUP BY c.id, c.title, c.description, c.duration_hours, c.is_active, c.created_at, u.full_name ORDER BY c.created_at DESC')
-        courses = [dict(r) for r in cur.fetchall()]
-        cur.close()
-        conn.close()
-        return {'statusCode': 200, 'headers': cors_headers, 'body': json.dumps({'courses': courses}, default=str), 'isBase64Encoded': False}
+        return {'statusCode': 200, 'headers': cors_headers, 'body': json.dumps({'courses': courses, 'next_cursor': next_cursor}, default=str), 'isBase64Encoded': False}
     
     elif method == 'POST':
+        if body_data.get('action') == 'bulk_assign':
+            return bulk_assign_departments(user, body_data, cors_headers, 'courses.edit', 'course_departments', 'course_id', 'course_ids')
+        if body_data.get('action') == 'assign':
+            return assign_course_with_deadline(user, body_data, cors_headers)
         if not has_permission(user['id'], 'courses.create'):
             return {'statusCode': 403, 'headers': cors_headers, 'body': json.dumps({'error': 'Permission denied'}), 'isBase64Encoded': False}
         title = body_data.get('title', '').strip()
@@ -981,11 +1814,11 @@ def handle_courses(method, user, body_data, headers, cors_headers, event):
             return {'statusCode': 400, 'headers': cors_headers, 'body': json.dumps({'error': 'Title required'}), 'isBase64Encoded': False}
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute('INSERT INTO courses (title, description, content, duration_hours, is_active, created_by) VALUES (%s, %s, %s, %s, %s, %s) RETURNING *', 
-                    (title, body_data.get('description', ''), body_data.get('content', ''), body_data.get('duration_hours'), body_data.get('is_active', True), user['id']))
+        cur.execute('INSERT INTO courses (title, description, duration_hours, is_active, created_by, terms) VALUES (%s, %s, %s, %s, %s, %s) RETURNING id, title, description, duration_hours, is_active, created_by, created_at, updated_at, content_hash, content_length', 
+                    (title, body_data.get('description', ''), body_data.get('duration_hours'), body_data.get('is_active', True), user['id'], catalog_terms(title, body_data.get('description', ''))))
         course = dict(cur.fetchone())
-        for dept_id in body_data.get('department_ids', []):
-            cur.execute('INSERT INTO course_departments (course_id, department_id) VALUES (%s, %s)', (course['id'], dept_id))
+        course.update(write_content(cur, 'course', course['id'], body_data.get('content', '')) or {})
+        sync_departments(cur, 'course_departments', 'course_id', course['id'], body_data.get('department_ids', []), replace=False)
         conn.commit()
         cur.close()
         conn.close()
@@ -1000,17 +1833,17 @@ def handle_courses(method, user, body_data, headers, cors_headers, event):
             return {'statusCode': 400, 'headers': cors_headers, 'body': json.dumps({'error': 'ID and title required'}), 'isBase64Encoded': False}
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute('UPDATE courses SET title=%s, description=%s, content=%s, duration_hours=%s, is_active=%s WHERE id=%s RETURNING *',
-                    (title, body_data.get('description'), body_data.get('content'), body_data.get('duration_hours'), body_data.get('is_active'), course_id))
+        cur.execute('UPDATE courses SET title=%s, description=%s, duration_hours=%s, is_active=%s, terms=%s WHERE id=%s RETURNING id, title, description, duration_hours, is_active, created_by, created_at, updated_at, content_hash, content_length',
+                    (title, body_data.get('description'), body_data.get('duration_hours'), body_data.get('is_active'), catalog_terms(title, body_data.get('description')), course_id))
         if cur.rowcount == 0:
             cur.close()
             conn.close()
             return {'statusCode': 404, 'headers': cors_headers, 'body': json.dumps({'error': 'Not found'}), 'isBase64Encoded': False}
         course = dict(cur.fetchone())
+        if 'content' in body_data:
+            course.update(write_content(cur, 'course', course['id'], body_data['content'], course['content_hash']) or {})
         if 'department_ids' in body_data:
-            cur.execute('UPDATE course_departments SET course_id = NULL WHERE course_id = %s', (course_id,))
-            for dept_id in body_data['department_ids']:
-                cur.execute('INSERT INTO course_departments (course_id, department_id) VALUES (%s, %s) ON CONFLICT DO NOTHING', (course_id, dept_id))
+            sync_departments(cur, 'course_departments', 'course_id', course_id, body_data['department_ids'])
         conn.commit()
         cur.close()
         conn.close()
@@ -1025,27 +1858,84 @@ def handle_trainers(method, user, body_data, headers, cors_headers, event):
         conn = get_db_connection()
         cur = conn.cursor()
         
+        if trainer_id and query_params.get('stats'):
+            # Distribution from the maintained histogram, top results from the best_score index - attempts are not scanned
+            cur.execute('''
+                SELECT json_build_object(
+                    'trainer_id', t.id,
+                    'attempts', COALESCE((SELECT SUM(attempts) FROM trainer_score_histogram WHERE trainer_id = t.id), 0),
+                    'avg_score', (SELECT ROUND(SUM(score_sum)::numeric / NULLIF(SUM(attempts), 0), 1) FROM trainer_score_histogram WHERE trainer_id = t.id),
+                    'avg_duration_seconds', (SELECT ROUND(SUM(duration_sum)::numeric / NULLIF(SUM(attempts), 0)) FROM trainer_score_histogram WHERE trainer_id = t.id),
+                    'histogram', COALESCE((
+                        SELECT json_agg(json_build_object('from', bucket * %s, 'to', CASE WHEN bucket = %s - 1 THEN 100 ELSE bucket * %s + %s - 1 END, 'attempts', attempts) ORDER BY bucket)
+                        FROM trainer_score_histogram WHERE trainer_id = t.id
+                    ), '[]'),
+                    'leaderboard', COALESCE((
+                        SELECT json_agg(json_build_object('user_id', top.user_id, 'full_name', u.full_name, 'best_score', top.best_score, 'attempts_count', top.attempts_count) ORDER BY top.best_score DESC, top.attempts_count)
+                        FROM (
+                            SELECT user_id, best_score, attempts_count FROM trainer_progress
+                            WHERE trainer_id = t.id AND attempts_count > 0
+                            ORDER BY best_score DESC
+                            LIMIT 10
+                        ) top
+                        INNER JOIN users u ON u.id = top.user_id
+                    ), '[]')
+                )::text as body
+                FROM trainers t
+                WHERE t.id = %s
+            ''', (100 // SCORE_BUCKETS, SCORE_BUCKETS, 100 // SCORE_BUCKETS, 100 // SCORE_BUCKETS, trainer_id))
+            stats = cur.fetchone()
+            cur.close()
+            conn.close()
+            if not stats:
+                return {'statusCode': 404, 'headers': cors_headers, 'body': json.dumps({'error': 'Not found'}), 'isBase64Encoded': False}
+            return {'statusCode': 200, 'headers': cors_headers, 'body': stats['body'], 'isBase64Encoded': False}
+        
         if trainer_id:
-            cur.execute('SELECT t.*, u.full_name as creator_name FROM trainers t LEFT JOIN users u ON u.id = t.created_by WHERE t.id = %s', (trainer_id,))
+            cur.execute('''
+                SELECT json_build_object('trainer', to_jsonb(t) - 'terms' - 'content_vector' - 'search_vector' || jsonb_build_object(
+                    'creator_name', u.full_name,
+                    'departments', COALESCE((
+                        SELECT jsonb_agg(jsonb_build_object('id', d.id, 'name', d.name, 'company_name', co.name))
+                        FROM trainer_departments td
+                        INNER JOIN departments d ON d.id = td.department_id
+                        INNER JOIN companies co ON co.id = d.company_id
+                        WHERE td.trainer_id = t.id
+                    ), '[]'::jsonb)
+                ))::text as body
+                FROM trainers t
+                LEFT JOIN users u ON u.id = t.created_by
+                WHERE t.id = %s
+            ''', (trainer_id,))
             trainer = cur.fetchone()
+            cur.close()
+            conn.close()
             if not trainer:
+                return {'statusCode': 404, 'headers': cors_headers, 'body': json.dumps({'error': 'Not found'}), 'isBase64Encoded': False}
+            return {'statusCode': 200, 'headers': cors_headers, 'body': trainer['body'], 'isBase64Encoded': False}
+        
+        if query_params.get('q'):
+            try:
+                trainers, next_cursor = search_catalog(cur, 'trainers', 'i.id, i.title, i.description, i.difficulty_level, i.is_active, i.created_at', query_params)
+            except ValueError:
+                return {'statusCode': 400, 'headers': cors_headers, 'body': json.dumps({'error': f'limit must be 1-{SEARCH_PAGE_SIZE_MAX} and cursor rank|id'}), 'isBase64Encoded': False}
+            finally:
                 cur.close()
                 conn.close()
-                return {'statusCode': 404, 'headers': cors_headers, 'body': json.dumps({'error': 'Not found'}), 'isBase64Encoded': False}
-            trainer = dict(trainer)
-            cur.execute('SELECT d.id, d.name, c.name as company_name FROM trainer_departments td INNER JOIN departments d ON d.id = td.department_id INNER JOIN companies c ON c.id = d.company_id WHERE td.trainer_id = %s', (trainer_id,))
-            trainer['departments'] = [dict(r) for r in cur.fetchall()]
+            return {'statusCode': 200, 'headers': cors_headers, 'body': json.dumps({'trainers': trainers, 'next_cursor': next_cursor}, default=str), 'isBase64Encoded': False}
+        
+        try:
+            trainers, next_cursor = list_catalog(cur, 'trainers', 'trainer_departments', 'trainer_id', 'i.id, i.title, i.description, i.difficulty_level, i.is_active, i.created_at', query_params)
+        except ValueError:
+            return {'statusCode': 400, 'headers': cors_headers, 'body': json.dumps({'error': f'limit must be 1-{LIST_PAGE_SIZE_MAX}, cursor created_at|id and department_id an integer'}), 'isBase64Encoded': False}
+        finally:
             cur.close()
             conn.close()
-            return {'statusCode': 200, 'headers': cors_headers, 'body': json.dumps({'trainer': trainer}, default=str), 'isBase64Encoded': False}
-        
-        cur.execute('SELECT t.id, t.title, t.description, t.difficulty_level, t.is_active, t.created_at, u.full_name as creator_name, COUNT(DISTINCT td.department_id) as departments_count FROM trainers t LEFT JOIN users u ON u.id = t.created_by LEFT JOIN trainer_departments td ON td.trainer_id = t.id GROUP BY t.id, t.title, t.description, t.difficulty_level, t.is_active, t.created_at, u.full_name ORDER BY t.created_at DESC')
-        trainers = [dict(r) for r in cur.fetchall()]
-        cur.close()
-        conn.close()
-        return {'statusCode': 200, 'headers': cors_headers, 'body': json.dumps({'trainers': trainers}, default=str), 'isBase64Encoded': False}
+        return {'statusCode': 200, 'headers': cors_headers, 'body': json.dumps({'trainers': trainers, 'next_cursor': next_cursor}, default=str), 'isBase64Encoded': False}
     
     elif method == 'POST':
+        if body_data.get('action') == 'bulk_assign':
+            return bulk_assign_departments(user, body_data, cors_headers, 'trainers.edit', 'trainer_departments', 'trainer_id', 'trainer_ids')
         if not has_permission(user['id'], 'trainers.create'):
             return {'statusCode': 403, 'headers': cors_headers, 'body': json.dumps({'error': 'Permission denied'}), 'isBase64Encoded': False}
         title = body_data.get('title', '').strip()
@@ -1053,11 +1943,11 @@ def handle_trainers(method, user, body_data, headers, cors_headers, event):
             return {'statusCode': 400, 'headers': cors_headers, 'body': json.dumps({'error': 'Title required'}), 'isBase64Encoded': False}
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute('INSERT INTO trainers (title, description, content, difficulty_level, is_active, created_by) VALUES (%s, %s, %s, %s, %s, %s) RETURNING *',
-                    (title, body_data.get('description', ''), body_data.get('content', ''), body_data.get('difficulty_level', ''), body_data.get('is_active', True), user['id']))
+        cur.execute('INSERT INTO trainers (title, description, difficulty_level, is_active, created_by, terms) VALUES (%s, %s, %s, %s, %s, %s) RETURNING id, title, description, difficulty_level, is_active, created_by, created_at, updated_at, content_hash, content_length',
+                    (title, body_data.get('description', ''), body_data.get('difficulty_level', ''), body_data.get('is_active', True), user['id'], catalog_terms(title, body_data.get('description', ''))))
         trainer = dict(cur.fetchone())
-        for dept_id in body_data.get('department_ids', []):
-            cur.execute('INSERT INTO trainer_departments (trainer_id, department_id) VALUES (%s, %s)', (trainer['id'], dept_id))
+        trainer.update(write_content(cur, 'trainer', trainer['id'], body_data.get('content', '')) or {})
+        sync_departments(cur, 'trainer_departments', 'trainer_id', trainer['id'], body_data.get('department_ids', []), replace=False)
         conn.commit()
         cur.close()
         conn.close()
@@ -1072,22 +1962,75 @@ def handle_trainers(method, user, body_data, headers, cors_headers, event):
             return {'statusCode': 400, 'headers': cors_headers, 'body': json.dumps({'error': 'ID and title required'}), 'isBase64Encoded': False}
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute('UPDATE trainers SET title=%s, description=%s, content=%s, difficulty_level=%s, is_active=%s WHERE id=%s RETURNING *',
-                    (title, body_data.get('description'), body_data.get('content'), body_data.get('difficulty_level'), body_data.get('is_active'), trainer_id))
+        cur.execute('UPDATE trainers SET title=%s, description=%s, difficulty_level=%s, is_active=%s, terms=%s WHERE id=%s RETURNING id, title, description, difficulty_level, is_active, created_by, created_at, updated_at, content_hash, content_length',
+                    (title, body_data.get('description'), body_data.get('difficulty_level'), body_data.get('is_active'), catalog_terms(title, body_data.get('description')), trainer_id))
         if cur.rowcount == 0:
             cur.close()
             conn.close()
             return {'statusCode': 404, 'headers': cors_headers, 'body': json.dumps({'error': 'Not found'}), 'isBase64Encoded': False}
         trainer = dict(cur.fetchone())
+        if 'content' in body_data:
+            trainer.update(write_content(cur, 'trainer', trainer['id'], body_data['content'], trainer['content_hash']) or {})
         if 'department_ids' in body_data:
-            cur.execute('UPDATE trainer_departments SET trainer_id = NULL WHERE trainer_id = %s', (trainer_id,))
-            for dept_id in body_data['department_ids']:
-                cur.execute('INSERT INTO trainer_departments (trainer_id, department_id) VALUES (%s, %s) ON CONFLICT DO NOTHING', (trainer_id, dept_id))
+            sync_departments(cur, 'trainer_departments', 'trainer_id', trainer_id, body_data['department_ids'])
         conn.commit()
         cur.close()
         conn.close()
         return {'statusCode': 200, 'headers': cors_headers, 'body': json.dumps({'trainer': trainer}, default=str), 'isBase64Encoded': False}
 
+# Entries shown on each side of a manager in the "you are #42" view
+LEADERBOARD_NEIGHBORS = 2
+LEADERBOARD_PAGE_SIZE_MAX = 100
+
+def read_leaderboard(cur, scope: str, scope_id: int, query_params: Dict, user_id: int) -> Dict:
+    """Ranked managers of one leaderboard: a page after cursor 'rank|manager_id', the neighbors of a manager, or the whole board.
+    Raises ValueError on a malformed around_manager_id, limit or cursor"""
+    base_query = '''
+        SELECT sm.*, u.username as name, u.email, c.name as company_name,
+               le.rank, le.wins as rank_wins, le.losses as rank_losses, le.score as rank_score
+        FROM leaderboard_entries le
+        INNER JOIN sales_managers sm ON sm.id = le.manager_id
+        INNER JOIN users u ON u.id = sm.user_id
+        INNER JOIN companies c ON c.id = sm.company_id
+        WHERE le.scope = %(scope)s AND le.scope_id = %(scope_id)s AND sm.status = 'active'
+    '''
+    params = {'scope': scope, 'scope_id': scope_id}
+    
+    around = int(query_params['around_manager_id']) if query_params.get('around_manager_id') else None
+    if query_params.get('me') and not around:
+        cur.execute('''
+            SELECT le.manager_id FROM leaderboard_entries le
+            INNER JOIN sales_managers sm ON sm.id = le.manager_id
+            WHERE le.scope = %(scope)s AND le.scope_id = %(scope_id)s AND sm.user_id = %(user_id)s
+            ORDER BY le.rank
+            LIMIT 1
+        ''', dict(params, user_id=user_id))
+        row = cur.fetchone()
+        around = row['manager_id'] if row else None
+    
+    if around:
+        cur.execute('SELECT rank FROM leaderboard_entries WHERE scope = %(scope)s AND scope_id = %(scope_id)s AND manager_id = %(manager_id)s',
+                    dict(params, manager_id=around))
+        row = cur.fetchone()
+        if not row:
+            return {'scope': scope, 'scope_id': scope_id, 'managers': [], 'me': None}
+        cur.execute(base_query + ' AND le.rank BETWEEN %(low)s AND %(high)s ORDER BY le.rank, le.manager_id',
+                    dict(params, low=row['rank'] - LEADERBOARD_NEIGHBORS, high=row['rank'] + LEADERBOARD_NEIGHBORS))
+        managers = [dict(r) for r in cur.fetchall()]
+        return {'scope': scope, 'scope_id': scope_id, 'managers': managers,
+                'me': next((m for m in managers if m['id'] == around), None)}
+    
+    if not query_params.get('limit'):
+        cur.execute(base_query + ' ORDER BY le.rank, le.manager_id', params)
+        return {'scope': scope, 'scope_id': scope_id, 'managers': [dict(r) for r in cur.fetchall()]}
+    
+    limit, (after_rank, after_id) = parse_page(query_params, LEADERBOARD_PAGE_SIZE_MAX, LEADERBOARD_PAGE_SIZE_MAX, (int, int))
+    cur.execute(base_query + ' AND (le.rank, le.manager_id) > (%(after_rank)s::int, %(after_id)s::int) ORDER BY le.rank, le.manager_id LIMIT %(limit)s',
+                dict(params, after_rank=after_rank or 0, after_id=after_id or 0, limit=limit + 1))
+    managers = [dict(r) for r in cur.fetchall()]
+    next_cursor = f"{managers[limit - 1]['rank']}|{managers[limit - 1]['id']}" if len(managers) > limit else None
+    return {'scope': scope, 'scope_id': scope_id, 'managers': managers[:limit], 'next_cursor': next_cursor}
+
 def handle_sales_managers(method, user, body_data, headers, cors_headers, event):
     conn = get_db_connection()
     cur = conn.cursor()
@@ -1096,31 +2039,29 @@ def handle_sales_managers(method, user, body_data, headers, cors_headers, event)
         if method == 'GET':
             query_params = event.get('queryStringParameters', {}) or {}
             company_id = query_params.get('company_id')
+            tournament_id = query_params.get('tournament_id')
             
-            if company_id:
-                cur.execute('''
-                    SELECT sm.*, u.username as name, u.email
-                    FROM sales_managers sm
-                    INNER JOIN users u ON u.id = sm.user_id
-                    WHERE sm.company_id = %s AND sm.status = 'active'
-                    ORDER BY sm.level DESC, sm.wins DESC
-                ''', (company_id,))
-            else:
-                cur.execute('''
-                    SELECT sm.*, u.username as name, u.email, c.name as company_name
-                    FROM sales_managers sm
-                    INNER JOIN users u ON u.id = sm.user_id
-                    INNER JOIN companies c ON c.id = sm.company_id
-                    WHERE sm.status = 'active'
-                    ORDER BY sm.level DESC, sm.wins DESC
-                ''')
-            
-            managers = [dict(row) for row in cur.fetchall()]
+            try:
+                if tournament_id:
+                    scope, scope_id = 'tournament', int(tournament_id)
+                elif company_id:
+                    scope, scope_id = 'company', int(company_id)
+                else:
+                    scope, scope_id = 'global', 0
+                
+                result = read_leaderboard(cur, scope, scope_id, query_params, user['id'])
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': cors_headers,
+                    'body': json.dumps({'error': f'company_id, tournament_id and around_manager_id must be integers, limit 1-{LEADERBOARD_PAGE_SIZE_MAX}, cursor rank|manager_id'}),
+                    'isBase64Encoded': False
+                }
             
             return {
                 'statusCode': 200,
                 'headers': cors_headers,
-                'body': json.dumps({'managers': managers}, default=str),
+                'body': json.dumps(result, default=str),
                 'isBase64Encoded': False
             }
         
@@ -1144,6 +2085,7 @@ def handle_sales_managers(method, user, body_data, headers, cors_headers, event)
             ''', (user_id, company_id, avatar))
             
             manager_id = cur.fetchone()['id']
+            cur.execute('SELECT leaderboard_refresh_manager(%s)', (manager_id,))
             conn.commit()
             
             return {
@@ -1156,6 +2098,52 @@ def handle_sales_managers(method, user, body_data, headers, cors_headers, event)
         cur.close()
         conn.close()
 
+# Upper bound on one long-poll wait, kept below the function timeout
+LONG_POLL_SECONDS = 25
+
+def wait_for_change(conn, channel: str, since_version: int, read, timeout: float):
+    """Read the delta after since_version, waiting up to timeout seconds for a NOTIFY on channel if nothing changed yet"""
+    cur = conn.cursor()
+    # LISTEN before the first read, so a change committed in between is not missed
+    cur.execute(f'LISTEN {channel}')
+    delta = read(cur)
+    deadline = time.time() + min(max(timeout, 0), LONG_POLL_SECONDS)
+    
+    while delta is not None and delta['version'] <= since_version:
+        remaining = deadline - time.time()
+        if remaining <= 0 or select.select([conn], [], [], remaining) == ([], [], []):
+            break
+        conn.poll()
+        notified = any(int(notify.payload) > since_version for notify in conn.notifies)
+        conn.notifies.clear()
+        if notified:
+            delta = read(cur)
+    
+    cur.close()
+    return delta
+
+def read_tournament_changes(cur, tournament_id: int, since_version: int):
+    """Tournament scalars and the bracket matches written after since_version"""
+    cur.execute('''
+        SELECT t.id, t.status, t.winner_id, t.completed_at, t.version,
+               COALESCE((
+                   SELECT json_agg(to_jsonb(tm) || jsonb_build_object(
+                       'player1_name', u1.username, 'player1_avatar', sm1.avatar,
+                       'player2_name', u2.username, 'player2_avatar', sm2.avatar
+                   ) ORDER BY tm.round, tm.match_order)
+                   FROM tournament_matches tm
+                   LEFT JOIN sales_managers sm1 ON sm1.id = tm.player1_id
+                   LEFT JOIN users u1 ON u1.id = sm1.user_id
+                   LEFT JOIN sales_managers sm2 ON sm2.id = tm.player2_id
+                   LEFT JOIN users u2 ON u2.id = sm2.user_id
+                   WHERE tm.tournament_id = t.id AND tm.version > %s
+               ), '[]') as matches
+        FROM tournaments t
+        WHERE t.id = %s
+    ''', (since_version, tournament_id))
+    row = cur.fetchone()
+    return dict(row) if row else None
+
 def handle_tournament(method, user, body_data, headers, cors_headers, event):
     conn = get_db_connection()
     cur = conn.cursor()
@@ -1173,10 +2161,63 @@ def handle_tournament(method, user, body_data, headers, cors_headers, event):
                     'isBase64Encoded': False
                 }
             
+            # Change feed: wait until the tournament version passes the client's, then return only what changed
+            if 'since_version' in query_params:
+                try:
+                    tournament_id = int(tournament_id)
+                    since_version = int(query_params.get('since_version') or 0)
+                    wait = float(query_params.get('wait') or LONG_POLL_SECONDS)
+                except ValueError:
+                    tournament_id, wait = None, -1
+                if wait < 0:
+                    return {
+                        'statusCode': 400,
+                        'headers': cors_headers,
+                        'body': json.dumps({'error': 'tournament_id and since_version must be integers, wait a non-negative number'}),
+                        'isBase64Encoded': False
+                    }
+                
+                conn.autocommit = True
+                changes = wait_for_change(
+                    conn, f'tournament_{tournament_id}', since_version,
+                    lambda cur: read_tournament_changes(cur, tournament_id, since_version),
+                    wait
+                )
+                
+                if not changes:
+                    return {
+                        'statusCode': 404,
+                        'headers': cors_headers,
+                        'body': json.dumps({'error': 'Tournament not found'}),
+                        'isBase64Encoded': False
+                    }
+                
+                changes['changed'] = changes['version'] > since_version
+                return {
+                    'statusCode': 200,
+                    'headers': cors_headers,
+                    'body': json.dumps(changes, default=str),
+                    'isBase64Encoded': False
+                }
+            
+            # Tournament with its bracket assembled as one JSON document
             cur.execute('''
-                SELECT t.*, 
-                       ca.name as company_a_name, 
-                       cb.name as company_b_name
+                SELECT json_build_object('tournament', to_jsonb(t) || jsonb_build_object(
+                    'company_a_name', ca.name,
+                    'company_b_name', cb.name,
+                    'matches', COALESCE((
+                        SELECT jsonb_agg(to_jsonb(tm) || jsonb_build_object(
+                            'player1_name', u1.username, 'player1_avatar', sm1.avatar,
+                            'player2_name', u2.username, 'player2_avatar', sm2.avatar
+                        ) ORDER BY tm.round, tm.match_order)
+                        FROM tournament_matches tm
+                        LEFT JOIN sales_managers sm1 ON sm1.id = tm.player1_id
+                        LEFT JOIN users u1 ON u1.id = sm1.user_id
+                        LEFT JOIN sales_managers sm2 ON sm2.id = tm.player2_id
+                        LEFT JOIN users u2 ON u2.id = sm2.user_id
+                        WHERE tm.tournament_id = t.id
+                    ), '[]'::jsonb)
+                ))::text as body
                 FROM tournaments t
                 INNER JOIN companies ca ON ca.id = t.company_a_id
                 INNER JOIN companies cb ON cb.id = t.company_b_id
@@ -1193,28 +2234,10 @@ def handle_tournament(method, user, body_data, headers, cors_headers, event):
                     'isBase64Encoded': False
                 }
             
-            cur.execute('''
-                SELECT tm.*,
-                       u1.username as player1_name, sm1.avatar as player1_avatar,
-                       u2.username as player2_name, sm2.avatar as player2_avatar
-                FROM tournament_matches tm
-                LEFT JOIN sales_managers sm1 ON sm1.id = tm.player1_id
-                LEFT JOIN users u1 ON u1.id = sm1.user_id
-                LEFT JOIN sales_managers sm2 ON sm2.id = tm.player2_id
-                LEFT JOIN users u2 ON u2.id = sm2.user_id
-                WHERE tm.tournament_id = %s
-                ORDER BY tm.round, tm.match_order
-            ''', (tournament_id,))
-            
-            matches = [dict(row) for row in cur.fetchall()]
-            
-            tournament_dict = dict(tournament)
-            tournament_dict['matches'] = matches
-            
             return {
                 'statusCode': 200,
                 'headers': cors_headers,
-                'body': json.dumps({'tournament': tournament_dict}, default=str),
+                'body': tournament['body'],
                 'isBase64Encoded': False
             }
         
@@ -1278,15 +2301,49 @@ def handle_tournament(method, user, body_data, headers, cors_headers, event):
         cur.close()
         conn.close()
 
+# Messages returned by one get_session or watch call
+BATTLE_MESSAGES_PAGE = 50
+BATTLE_MESSAGES_PAGE_MAX = 200
+
+def read_battle_session(cur, session_id, user_id: int, since_seq: int, limit: int, with_messages: bool):
+    """Scalar state of the user's own session; with_messages adds the messages after since_seq, at most limit of them"""
+    messages_column = '''COALESCE((
+            SELECT json_agg(json_build_object('seq', bm.seq, 'role', bm.role, 'content', bm.content, 'timestamp', bm.created_at) ORDER BY bm.seq)
+            FROM (
+                SELECT seq, role, content, created_at FROM battle_messages
+                WHERE session_id = bs.id AND seq > %(since_seq)s
+                ORDER BY seq
+                LIMIT %(limit)s
+            ) bm
+        ), '[]') as messages''' if with_messages else 'NULL as messages'
+    cur.execute(f'''
+        SELECT bs.id, bs.match_id, bs.manager_id, bs.current_phase, bs.phase_scores, bs.total_score,
+               bs.timer_remaining, bs.status, bs.message_count, bs.version, bs.updated_at, {messages_column}
+        FROM battle_sessions bs
+        INNER JOIN sales_managers sm ON sm.id = bs.manager_id
+        WHERE bs.id = %(session_id)s AND sm.user_id = %(user_id)s
+    ''', {'session_id': session_id, 'user_id': user_id, 'since_seq': since_seq, 'limit': limit})
+    
+    session = cur.fetchone()
+    if not session:
+        return None
+    
+    session = dict(session)
+    messages = session.pop('messages')
+    result = {'session': session, 'version': session['version']}
+    if with_messages:
+        last_seq = messages[-1]['seq'] if messages else since_seq
+        result.update({'messages': messages, 'last_seq': last_seq, 'has_more': last_seq < session['message_count']})
+    return result
+
 def handle_battle(method, user, body_data, headers, cors_headers, event):
     import random
-    from datetime import datetime
     
     conn = get_db_connection()
     cur = conn.cursor()
     
     try:
-        action = body_data.get('action') if method == 'POST' else event.get('queryStringParameters', {}).get('action')
+        action = body_data.get('action') if method == 'POST' else (event.get('queryStringParameters') or {}).get('action')
         
         if action == 'start_match':
             match_id = body_data.get('match_id')
@@ -1312,10 +2369,10 @@ def handle_battle(method, user, body_data, headers, cors_headers, event):
             
             cur.execute('''
                 INSERT INTO battle_sessions 
-                (match_id, manager_id, current_phase, chat_history, phase_scores, timer_remaining, status)
-                VALUES (%s, %s, 'greeting', %s, %s, 300, 'active')
+                (match_id, manager_id, current_phase, phase_scores, timer_remaining, status)
+                VALUES (%s, %s, 'greeting', %s, 300, 'active')
                 RETURNING id
-            ''', (match_id, manager_id, json.dumps([]), json.dumps({})))
+            ''', (match_id, manager_id, json.dumps({})))
             
             session_id = cur.fetchone()['id']
             conn.commit()
@@ -1331,34 +2388,40 @@ def handle_battle(method, user, body_data, headers, cors_headers, event):
             session_id = body_data.get('session_id')
             message = body_data.get('message')
             
-            cur.execute('''
-                SELECT bs.*, sm.user_id
-                FROM battle_sessions bs
-                INNER JOIN sales_managers sm ON sm.id = bs.manager_id
-                WHERE bs.id = %s
-            ''', (session_id,))
-            
-            session = cur.fetchone()
-            if not session or session['user_id'] != user['id']:
-                return {'statusCode': 403, 'headers': cors_headers, 'body': json.dumps({'error': 'Access denied'}), 'isBase64Encoded': False}
-            
-            chat_history = session['chat_history'] or []
-            chat_history.append({'role': 'manager', 'content': message, 'timestamp': datetime.now().isoformat()})
-            
             ai_response_text = random.choice(['Звучит интересно!', 'Расскажите подробнее', 'А какова стоимость?'])
             score = random.randint(10, 20)
             
-            chat_history.append({'role': 'client', 'content': ai_response_text, 'timestamp': datetime.now().isoformat()})
-            
-            phase_scores = session['phase_scores'] or {}
-            phase_scores[session['current_phase']] = score
-            total_score = sum(phase_scores.values())
-            
+            # One statement: ownership and status guard, phase score set, total recomputed and messages appended
+            # under the session row lock, so concurrent messages cannot lose each other's updates
             cur.execute('''
-                UPDATE battle_sessions
-                SET chat_history = %s, phase_scores = %s, total_score = %s, updated_at = NOW()
-                WHERE id = %s
-            ''', (json.dumps(chat_history), json.dumps(phase_scores), total_score, session_id))
+                WITH session AS (
+                    UPDATE battle_sessions bs
+                    SET phase_scores = jsonb_set(COALESCE(bs.phase_scores, '{}'::jsonb), ARRAY[bs.current_phase::text], to_jsonb(%(score)s::int)),
+                        total_score = (
+                            SELECT COALESCE(SUM(value::int), 0)
+                            FROM jsonb_each_text(jsonb_set(COALESCE(bs.phase_scores, '{}'::jsonb), ARRAY[bs.current_phase::text], to_jsonb(%(score)s::int)))
+                        ),
+                        message_count = bs.message_count + 2,
+                        updated_at = NOW()
+                    FROM sales_managers sm
+                    WHERE bs.id = %(session_id)s AND bs.status = 'active'
+                      AND sm.id = bs.manager_id AND sm.user_id = %(user_id)s
+                    RETURNING bs.id, bs.message_count, bs.total_score
+                ),
+                messages AS (
+                    INSERT INTO battle_messages (session_id, seq, role, content)
+                    SELECT id, message_count - 1, 'manager', %(message)s FROM session
+                    UNION ALL
+                    SELECT id, message_count, 'client', %(reply)s FROM session
+                )
+                SELECT total_score FROM session
+            ''', {'score': score, 'session_id': session_id, 'user_id': user['id'], 'message': message, 'reply': ai_response_text})
+            
+            session = cur.fetchone()
+            if not session:
+                conn.rollback()
+                return {'statusCode': 403, 'headers': cors_headers, 'body': json.dumps({'error': 'Access denied'}), 'isBase64Encoded': False}
+            total_score = session['total_score']
             
             conn.commit()
             
@@ -1405,6 +2468,8 @@ def handle_battle(method, user, body_data, headers, cors_headers, event):
             else:
                 cur.execute('UPDATE sales_managers SET losses = losses + 1, total_score = total_score + %s WHERE id = %s', (player_score, session['manager_id']))
             
+            cur.execute('SELECT leaderboard_record_match(%s)', (session['match_id'],))
+            
             conn.commit()
             
             return {
@@ -1414,25 +2479,37 @@ def handle_battle(method, user, body_data, headers, cors_headers, event):
                 'isBase64Encoded': False
             }
         
-        elif action == 'get_session':
+        elif action in ('get_session', 'session_state', 'watch'):
             query_params = event.get('queryStringParameters', {}) or {}
-            session_id = query_params.get('session_id')
-            
-            cur.execute('''
-                SELECT bs.*, sm.user_id
-                FROM battle_sessions bs
-                INNER JOIN sales_managers sm ON sm.id = bs.manager_id
-                WHERE bs.id = %s
-            ''', (session_id,))
+            try:
+                session_id = int(query_params.get('session_id'))
+                since_seq = int(query_params.get('since_seq') or 0)
+                limit = min(int(query_params.get('limit') or BATTLE_MESSAGES_PAGE), BATTLE_MESSAGES_PAGE_MAX)
+                since_version = int(query_params.get('since_version') or 0)
+                wait = float(query_params.get('wait') or LONG_POLL_SECONDS)
+            except (TypeError, ValueError):
+                return {'statusCode': 400, 'headers': cors_headers, 'body': json.dumps({'error': 'Numeric session_id required; since_seq, limit, since_version and wait must be numbers'}), 'isBase64Encoded': False}
+            if since_seq < 0 or limit < 1 or wait < 0:
+                return {'statusCode': 400, 'headers': cors_headers, 'body': json.dumps({'error': 'since_seq and wait must be non-negative, limit positive'}), 'isBase64Encoded': False}
+            read = lambda cur: read_battle_session(cur, session_id, user['id'], since_seq, limit, action != 'session_state')
+            
+            if action == 'watch':
+                # Change feed: wait until the session version passes the client's, then return the new messages
+                conn.autocommit = True
+                result = wait_for_change(conn, f'battle_{session_id}', since_version, read, wait)
+            else:
+                result = read(cur)
             
-            session = cur.fetchone()
-            if not session or session['user_id'] != user['id']:
+            if not result:
                 return {'statusCode': 403, 'headers': cors_headers, 'body': json.dumps({'error': 'Access denied'}), 'isBase64Encoded': False}
             
+            if action == 'watch':
+                result['changed'] = result['version'] > since_version
+            
             return {
                 'statusCode': 200,
                 'headers': cors_headers,
-                'body': json.dumps({'session': dict(session)}, default=str),
+                'body': json.dumps(result, default=str),
                 'isBase64Encoded': False
             }
         
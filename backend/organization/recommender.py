@@ -0,0 +1,444 @@
+'''
+Business: Course and trainer recommendations - token index over the catalog and similarity scoring
+Args: catalog rows loaded by index.py, completed course/trainer ids of a user
+Returns: ranked course and trainer recommendations with reasons
+'''
+
+import json
+import hashlib
+import zlib
+from collections import defaultdict
+import numpy as np
+from psycopg2.extras import execute_values
+import tokenizer
+
+SIMILARITY_THRESHOLD = 0.1
+TOP_N = 5
+
+# Score weight of a similarity, by (candidate kind, completed item kind)
+SIMILARITY_WEIGHTS = {
+    ('course', 'course'): 10,
+    ('course', 'trainer'): 5,
+    ('trainer', 'trainer'): 10,
+    ('trainer', 'course'): 8
+}
+
+SIMILARITY_REASONS = {
+    ('course', 'course'): 'Similar to "{}"',
+    ('course', 'trainer'): 'Matches trainer: {}',
+    ('trainer', 'trainer'): 'Similar to "{}"',
+    ('trainer', 'course'): 'Matches course: {}'
+}
+
+# MinHash signature length and its split into LSH bands. The candidate threshold (1 / bands) ** (1 / rows) must stay
+# at or below SIMILARITY_THRESHOLD, or LSH drops pairs exact mode keeps: 64 bands of 1 row put it at 1/64, and a pair
+# at exactly 0.1 Jaccard becomes a candidate with probability 1 - 0.9 ** 64 = 0.9988
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 64
+MINHASH_PRIME = 2147483647
+
+# Fixed seeds keep signatures comparable across instances, which is what makes persisting them valid
+MINHASH_A = np.random.RandomState(20240601).randint(1, MINHASH_PRIME, size=MINHASH_PERMUTATIONS).astype(np.int64)
+MINHASH_B = np.random.RandomState(20240602).randint(0, MINHASH_PRIME, size=MINHASH_PERMUTATIONS).astype(np.int64)
+
+# Warm-instance index: {'version': catalog version, 'index': CatalogIndex}
+CATALOG_INDEX = {}
+
+def load_catalog(cur):
+    cur.execute('''
+        SELECT id, title, COALESCE(description, '') as description, duration_hours, is_active, terms
+        FROM courses
+        ORDER BY id
+    ''')
+    courses = [dict(row) for row in cur.fetchall()]
+    
+    cur.execute('''
+        SELECT id, title as name, COALESCE(description, '') as specialization,
+               COALESCE(difficulty_level, '') as difficulty_level, is_active, terms
+        FROM trainers
+        ORDER BY id
+    ''')
+    trainers = [dict(row) for row in cur.fetchall()]
+    
+    return courses, trainers
+
+def get_catalog_index(cur, version: int):
+    """Return the token index for this catalog version, rebuilding it only when the version changed"""
+    if CATALOG_INDEX.get('version') != version:
+        courses, trainers = load_catalog(cur)
+        CATALOG_INDEX['index'] = CatalogIndex(courses, trainers)
+        CATALOG_INDEX['version'] = version
+        store_missing_terms(cur, CATALOG_INDEX['index'])
+    return CATALOG_INDEX['index']
+
+def store_missing_terms(cur, index):
+    """Save terms of rows written before terms were stored, so they are normalized only once"""
+    for kind, table in [('course', 'courses'), ('trainer', 'trainers')]:
+        rows = [(item['id'], json.dumps(item['terms'])) for item in index.items if item['kind'] == kind and item['row'].get('terms') is None]
+        if rows:
+            execute_values(cur, f'UPDATE {table} SET terms = v.terms::jsonb FROM (VALUES %s) AS v(id, terms) WHERE {table}.id = v.id', rows)
+
+class CatalogIndex:
+    """Catalog items with token sets as integer ids and an inverted index from token to items"""
+    
+    def __init__(self, courses, trainers):
+        self.items = []
+        self.positions = {}
+        self.token_ids = {}
+        self.tokens = []
+        self.postings = []
+        
+        for course in courses:
+            self.add_item('course', course, course['title'] + ' ' + course['description'])
+        for trainer in trainers:
+            self.add_item('trainer', trainer, trainer['name'] + ' ' + trainer['specialization'])
+        
+        # Bonus candidates are fixed per catalog, so they are collected once here
+        self.short_courses = [p for p, item in enumerate(self.items)
+                              if item['kind'] == 'course' and item['is_active'] and (item['row']['duration_hours'] or 999) <= 20]
+        self.trainers_by_level = defaultdict(list)
+        for p, item in enumerate(self.items):
+            if item['kind'] == 'trainer' and item['is_active']:
+                self.trainers_by_level[item['row']['difficulty_level']].append(p)
+        
+        self.beginner_courses = self.rank_beginner_courses()
+        self.beginner_trainers = self.rank_beginner_trainers()
+        self.tfidf = None
+        self.lsh = None
+    
+    def add_item(self, kind, row, text):
+        terms = row['terms'] if row.get('terms') is not None else tokenizer.term_counts(text)
+        counts = {}
+        for token, count in terms.items():
+            if token not in self.token_ids:
+                self.token_ids[token] = len(self.postings)
+                self.tokens.append(token)
+                self.postings.append([])
+            counts[self.token_ids[token]] = count
+        
+        position = len(self.items)
+        for token_id in counts:
+            self.postings[token_id].append(position)
+        
+        self.items.append({'kind': kind, 'id': row['id'], 'is_active': row['is_active'], 'tokens': frozenset(counts), 'counts': counts, 'terms': terms, 'row': row})
+        self.positions[(kind, row['id'])] = position
+    
+    def label(self, position):
+        item = self.items[position]
+        return item['row']['title'] if item['kind'] == 'course' else item['row']['name']
+    
+    def similarities(self, position):
+        """Jaccard similarity of one item to every item sharing a token with it, found by walking postings"""
+        overlaps = defaultdict(int)
+        for token_id in self.items[position]['tokens']:
+            for other in self.postings[token_id]:
+                overlaps[other] += 1
+        overlaps.pop(position, None)
+        
+        size = len(self.items[position]['tokens'])
+        return {other: count / (size + len(self.items[other]['tokens']) - count) for other, count in overlaps.items()}
+    
+    def rank_beginner_courses(self):
+        ranked = []
+        for p, item in enumerate(self.items):
+            if item['kind'] != 'course' or not item['is_active']:
+                continue
+            row = item['row']
+            score = 0
+            reasons = []
+            if (row['duration_hours'] or 999) <= 10:
+                score += 5
+                reasons.append('Short duration - beginner friendly')
+            if tokenizer.BEGINNER_TERMS.intersection(item['terms']):
+                score += 10
+                reasons.append('Beginner level content')
+            if tokenizer.INTRO_TERMS.intersection(item['terms']):
+                score += 8
+                reasons.append('Introductory course')
+            ranked.append((p, score + 1, reasons or ['Great starting point']))
+        ranked.sort(key=lambda r: -r[1])
+        return ranked
+    
+    def rank_beginner_trainers(self):
+        ranked = []
+        for p, item in enumerate(self.items):
+            if item['kind'] != 'trainer' or not item['is_active']:
+                continue
+            row = item['row']
+            score = 0
+            reasons = []
+            if row['difficulty_level'].lower() in tokenizer.BEGINNER_LEVELS:
+                score += 10
+                reasons.append('Beginner-friendly trainer')
+            if tokenizer.INTRO_TERMS.intersection(item['terms']):
+                score += 5
+                reasons.append('Introductory training')
+            ranked.append((p, score + 1, reasons or ['Recommended for new learners']))
+        ranked.sort(key=lambda r: -r[1])
+        return ranked
+
+class TfidfModel:
+    """L2-normalized TF-IDF rows of the catalog in CSR arrays, scored with vectorized sparse products"""
+    
+    def __init__(self, index):
+        n_items = len(index.items)
+        n_tokens = len(index.postings)
+        
+        document_frequency = np.array([len(posting) for posting in index.postings], dtype=np.float64)
+        idf = np.log((1 + n_items) / (1 + document_frequency)) + 1
+        
+        lengths = [len(item['counts']) for item in index.items]
+        self.indptr = np.zeros(n_items + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum(lengths)
+        self.indices = np.fromiter((t for item in index.items for t in item['counts']), dtype=np.int64, count=int(self.indptr[-1]))
+        counts = np.fromiter((c for item in index.items for c in item['counts'].values()), dtype=np.float64, count=int(self.indptr[-1]))
+        self.rows = np.repeat(np.arange(n_items), lengths)
+        
+        data = counts * idf[self.indices]
+        norms = np.sqrt(np.bincount(self.rows, weights=data * data, minlength=n_items))
+        norms[norms == 0] = 1
+        self.data = data / norms[self.rows]
+        self.n_items = n_items
+        self.n_tokens = n_tokens
+        
+        self.is_course = np.array([item['kind'] == 'course' for item in index.items], dtype=bool)
+        self.is_active = np.array([bool(item['is_active']) for item in index.items], dtype=bool)
+        self.duration_bonus = np.zeros(n_items, dtype=np.float64)
+        self.duration_bonus[index.short_courses] = 2
+        self.trainers_by_level = index.trainers_by_level
+    
+    def profile(self, positions, weights):
+        """Weighted sum of the given rows as a dense token vector"""
+        vector = np.zeros(self.n_tokens, dtype=np.float64)
+        for position, weight in zip(positions, weights):
+            start, end = self.indptr[position], self.indptr[position + 1]
+            np.add.at(vector, self.indices[start:end], weight * self.data[start:end])
+        return vector
+    
+    def scores(self, profile):
+        """Sparse matrix-vector product of every catalog row with the profile"""
+        return np.bincount(self.rows, weights=self.data * profile[self.indices], minlength=self.n_items)
+    
+    def similarity(self, a, b):
+        a_start, a_end = self.indptr[a], self.indptr[a + 1]
+        b_start, b_end = self.indptr[b], self.indptr[b + 1]
+        _, a_hits, b_hits = np.intersect1d(self.indices[a_start:a_end], self.indices[b_start:b_end], assume_unique=True, return_indices=True)
+        return float(np.dot(self.data[a_start:a_end][a_hits], self.data[b_start:b_end][b_hits]))
+
+def get_tfidf_model(index):
+    if index.tfidf is None:
+        index.tfidf = TfidfModel(index)
+    return index.tfidf
+
+def recommend_tfidf(index, completed_course_ids, completed_trainer_ids):
+    """Same response as recommend(), scored by cosine similarity of TF-IDF rows to the user's profile"""
+    completed_courses = [index.positions[('course', i)] for i in completed_course_ids if ('course', i) in index.positions]
+    completed_trainers = [index.positions[('trainer', i)] for i in completed_trainer_ids if ('trainer', i) in index.positions]
+    
+    if not completed_courses and not completed_trainers:
+        return recommend(index, completed_course_ids, completed_trainer_ids)
+    
+    model = get_tfidf_model(index)
+    sources = completed_courses + completed_trainers
+    available = model.is_active.copy()
+    available[sources] = False
+    level = index.items[completed_trainers[-1]]['row']['difficulty_level'] if completed_trainers else None
+    
+    def rank(kind, mask, bonus, bonus_reason):
+        weights = [SIMILARITY_WEIGHTS[(kind, index.items[s]['kind'])] for s in sources]
+        scores = model.scores(model.profile(sources, weights)) + bonus
+        scores[~(mask & available)] = 0
+        
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > TOP_N:
+            candidates = candidates[np.argpartition(-scores[candidates], TOP_N - 1)[:TOP_N]]
+        candidates = sorted(candidates.tolist(), key=lambda p: (-round(scores[p], 2), p))
+        
+        result = []
+        for p in candidates:
+            # Reasons are the completed items contributing most to this candidate's score
+            contributions = [(w * model.similarity(p, s), s) for s, w in zip(sources, weights)]
+            reasons = [SIMILARITY_REASONS[(kind, index.items[s]['kind'])].format(index.label(s))
+                       for c, s in sorted(contributions, key=lambda r: -r[0]) if c > 0]
+            if bonus[p]:
+                reasons.append(bonus_reason)
+            result.append(format_recommendation(index, p, float(scores[p]), reasons[:3]))
+        return result
+    
+    level_bonus = np.zeros(model.n_items, dtype=np.float64)
+    if level is not None:
+        level_bonus[model.trainers_by_level.get(level, [])] = 3
+    
+    return {
+        'courses': rank('course', model.is_course, model.duration_bonus, 'Manageable duration'),
+        'trainers': rank('trainer', ~model.is_course, level_bonus, f'Matches your level: {level}'),
+        'stats': {
+            'completed_courses': len(completed_course_ids),
+            'completed_trainers': len(completed_trainer_ids)
+        }
+    }
+
+def json_body(result):
+    """Response body of a recommendation result, identical for online and batch computation"""
+    return json.dumps(result, default=str)
+
+def format_recommendation(index, position, score, reasons):
+    item = index.items[position]
+    row = item['row']
+    if item['kind'] == 'course':
+        return {
+            'id': row['id'],
+            'title': row['title'],
+            'description': row['description'],
+            'duration_hours': row['duration_hours'],
+            'score': round(score, 2),
+            'reasons': reasons
+        }
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'specialization': row['specialization'],
+        'difficulty_level': row['difficulty_level'],
+        'score': round(score, 2),
+        'reasons': reasons
+    }
+
+def minhash_signature(tokens):
+    """MinHash of a token set under MINHASH_PERMUTATIONS hash functions (a * x + b) mod p"""
+    if not tokens:
+        return [MINHASH_PRIME] * MINHASH_PERMUTATIONS
+    values = np.array([zlib.crc32(token.encode('utf-8')) % MINHASH_PRIME for token in tokens], dtype=np.int64)
+    return ((MINHASH_A[:, None] * values[None, :] + MINHASH_B[:, None]) % MINHASH_PRIME).min(axis=1).tolist()
+
+def tokens_hash(tokens):
+    return hashlib.sha256('\n'.join(sorted(tokens)).encode('utf-8')).hexdigest()
+
+class LshIndex:
+    """LSH buckets over MinHash signatures; candidates come from shared buckets and are then scored exactly"""
+    
+    def __init__(self, index, signatures):
+        self.index = index
+        self.signatures = signatures
+        self.buckets = defaultdict(list)
+        self.bands = []
+        rows = MINHASH_PERMUTATIONS // LSH_BANDS
+        for position, signature in enumerate(signatures):
+            keys = [(band, tuple(signature[band * rows:(band + 1) * rows])) for band in range(LSH_BANDS)]
+            self.bands.append(keys)
+            if self.index.items[position]['tokens']:
+                for key in keys:
+                    self.buckets[key].append(position)
+    
+    def similarities(self, position):
+        """Exact Jaccard similarity to LSH candidates of one item"""
+        tokens = self.index.items[position]['tokens']
+        candidates = set()
+        for key in self.bands[position]:
+            candidates.update(self.buckets[key])
+        candidates.discard(position)
+        
+        result = {}
+        for candidate in candidates:
+            other = self.index.items[candidate]['tokens']
+            overlap = len(tokens & other)
+            if overlap:
+                result[candidate] = overlap / (len(tokens) + len(other) - overlap)
+        return result
+
+def get_lsh_index(cur, index):
+    """LSH index of the catalog; signatures are read from item_signatures and only missing or stale ones are computed"""
+    if index.lsh is not None:
+        return index.lsh
+    
+    cur.execute('SELECT item_type, item_id, tokens_hash, signature FROM item_signatures')
+    stored = {(row['item_type'], row['item_id']): row for row in cur.fetchall()}
+    
+    signatures = []
+    updated = []
+    for item in index.items:
+        tokens = [index.tokens[t] for t in item['tokens']]
+        digest = tokens_hash(tokens)
+        row = stored.get((item['kind'], item['id']))
+        if row and row['tokens_hash'] == digest and len(row['signature']) == MINHASH_PERMUTATIONS:
+            signatures.append(row['signature'])
+        else:
+            signature = minhash_signature(tokens)
+            signatures.append(signature)
+            updated.append((item['kind'], item['id'], digest, signature))
+    
+    if updated:
+        execute_values(cur, '''
+            INSERT INTO item_signatures (item_type, item_id, tokens_hash, signature)
+            VALUES %s
+            ON CONFLICT (item_type, item_id) DO UPDATE SET
+                tokens_hash = EXCLUDED.tokens_hash,
+                signature = EXCLUDED.signature,
+                updated_at = CURRENT_TIMESTAMP
+        ''', updated, template='(%s, %s, %s, %s::int[])')
+    
+    index.lsh = LshIndex(index, signatures)
+    return index.lsh
+
+def recommend_lsh(cur, index, completed_course_ids, completed_trainer_ids):
+    """Same response as recommend(), with similar items found through LSH buckets instead of full postings"""
+    lsh = get_lsh_index(cur, index)
+    return recommend(index, completed_course_ids, completed_trainer_ids, similarities=lsh.similarities)
+
+def recommend(index, completed_course_ids, completed_trainer_ids, similarities=None):
+    """Score catalog items against the user's completed items, walking only postings of their tokens"""
+    similarities = similarities or index.similarities
+    completed_courses = [index.positions[('course', i)] for i in completed_course_ids if ('course', i) in index.positions]
+    completed_trainers = [index.positions[('trainer', i)] for i in completed_trainer_ids if ('trainer', i) in index.positions]
+    completed = set(completed_courses) | set(completed_trainers)
+    
+    if not completed:
+        return {
+            'courses': [format_recommendation(index, p, s, r) for p, s, r in index.beginner_courses[:TOP_N]],
+            'trainers': [format_recommendation(index, p, s, r) for p, s, r in index.beginner_trainers[:TOP_N]],
+            'stats': {'completed_courses': 0, 'completed_trainers': 0}
+        }
+    
+    scores = defaultdict(float)
+    matches = defaultdict(dict)
+    for source in completed_courses + completed_trainers:
+        source_kind = index.items[source]['kind']
+        for candidate, similarity in similarities(source).items():
+            if similarity <= SIMILARITY_THRESHOLD or candidate in completed or not index.items[candidate]['is_active']:
+                continue
+            scores[candidate] += SIMILARITY_WEIGHTS[(index.items[candidate]['kind'], source_kind)] * similarity
+            matches[candidate][source] = True
+    
+    level = index.items[completed_trainers[-1]]['row']['difficulty_level'] if completed_trainers else None
+    
+    def rank(kind, sources, bonus_positions, bonus, bonus_reason):
+        ranked = {p: s for p, s in scores.items() if index.items[p]['kind'] == kind}
+        bonus_set = set(bonus_positions)
+        for p in ranked:
+            if p in bonus_set:
+                ranked[p] += bonus
+        # Items with only the bonus tie at the same score, so the first TOP_N of them are enough
+        extra = 0
+        for p in bonus_positions:
+            if extra >= TOP_N:
+                break
+            if p not in ranked and p not in completed:
+                ranked[p] = bonus
+                extra += 1
+        
+        result = []
+        for p, score in sorted(ranked.items(), key=lambda r: (-round(r[1], 2), r[0]))[:TOP_N]:
+            reasons = [SIMILARITY_REASONS[(kind, index.items[s]['kind'])].format(index.label(s)) for s in sources if s in matches[p]]
+            if p in bonus_set:
+                reasons.append(bonus_reason)
+            result.append(format_recommendation(index, p, score, reasons[:3]))
+        return result
+    
+    return {
+        'courses': rank('course', completed_courses + completed_trainers, index.short_courses, 2, 'Manageable duration'),
+        'trainers': rank('trainer', completed_trainers + completed_courses,
+                         index.trainers_by_level.get(level, []) if level is not None else [], 3, f'Matches your level: {level}'),
+        'stats': {
+            'completed_courses': len(completed_course_ids),
+            'completed_trainers': len(completed_trainer_ids)
+        }
+    }
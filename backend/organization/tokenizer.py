@@ -0,0 +1,54 @@
+'''
+Business: Text normalization for catalog matching - words without punctuation, stop words and inflection endings
+Args: course/trainer title and description text in Russian or English
+Returns: stemmed terms with their number of occurrences
+'''
+
+import re
+from collections import Counter
+
+WORD_RE = re.compile(r'[a-zа-я0-9]+')
+
+# Terms shorter than this are dropped, endings are never cut below it
+MIN_STEM_LENGTH = 3
+
+STOP_WORDS = frozenset('''
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было вот от меня еще нет о из ему
+теперь когда даже ну вдруг ли если уже или ни быть был него до вас нибудь опять уж вам ведь там потом себя ничего ей может они тут
+где есть надо ней для мы тебя их чем была сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой
+совсем ним здесь этом один почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при наконец два об другой хоть после
+над больше тот через эти нас про всего них какая много разве три эту моя впрочем хорошо свою этой перед иногда лучше чуть том
+нельзя такой им более всегда конечно всю между это также курс курса курсе тренажер тренажера
+a an and are as at be by for from has have in is it its of on or that the this to was were will with your you how what
+course training trainer
+'''.split())
+
+RU_ENDINGS = sorted('''
+иями ями ами иях ях ах иям ям ам ией ей ой ий ый ого его ому ему ыми ими ым им ых их ом ем ую юю ая яя ое ее ые ие ия ии ию
+ать ять ить еть ует уют ешь ет ют ит ат ят ла ли ло
+ов ев а я о е ы и у ю ь й
+'''.split(), key=len, reverse=True)
+
+EN_ENDINGS = sorted('ations ation ings ing edly ed ies es s ly'.split(), key=len, reverse=True)
+
+def stem(word):
+    """Cut the longest known inflection ending, keeping at least MIN_STEM_LENGTH letters"""
+    endings = RU_ENDINGS if 'а' <= word[0] <= 'я' else EN_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+def normalize(text):
+    """Stemmed terms of text in order, without punctuation, stop words and very short words"""
+    words = WORD_RE.findall((text or '').lower().replace('ё', 'е'))
+    return [stem(word) for word in words if word not in STOP_WORDS and len(word) >= MIN_STEM_LENGTH]
+
+def term_counts(text):
+    """Stemmed terms of text with their number of occurrences"""
+    return dict(Counter(normalize(text)))
+
+# Marker terms of beginner material, in stemmed form so they match any inflection
+BEGINNER_TERMS = frozenset(normalize('beginner beginners начинающих новичков начальный'))
+INTRO_TERMS = frozenset(normalize('introduction introductory введение вводный основы базовый'))
+BEGINNER_LEVELS = frozenset(['beginner', 'easy', 'начальный', 'легкий', 'легко'])
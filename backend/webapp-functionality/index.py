@@ -62,12 +62,14 @@ def handler(event, context):
             elif entity_type == 'sales_manager':
                 company_id = params.get('company_id')
                 if company_id:
+                    # Company leaderboard is kept ranked on match completion, so this is an index range read
                     cur.execute(f"""
-                        SELECT sm.id, u.username, sm.avatar, sm.level, sm.wins, sm.losses, sm.company_id
-                        FROM t_p66738329_webapp_functionality.sales_managers sm
+                        SELECT sm.id, u.username, sm.avatar, sm.level, sm.wins, sm.losses, sm.company_id, le.rank
+                        FROM t_p66738329_webapp_functionality.leaderboard_entries le
+                        JOIN t_p66738329_webapp_functionality.sales_managers sm ON sm.id = le.manager_id
                         JOIN t_p66738329_webapp_functionality.users u ON sm.user_id = u.id
-                        WHERE sm.company_id = {int(company_id)} AND sm.status = 'active'
-                        ORDER BY sm.level DESC, sm.wins DESC
+                        WHERE le.scope = 'company' AND le.scope_id = {int(company_id)} AND sm.status = 'active'
+                        ORDER BY le.rank, le.manager_id
                     """)
                     
                     managers = []
@@ -79,7 +81,8 @@ def handler(event, context):
                             'level': row[3],
                             'wins': row[4],
                             'losses': row[5],
-                            'company_id': row[6]
+                            'company_id': row[6],
+                            'rank': row[7]
                         })
                     
                     return {
@@ -264,24 +267,6 @@ def handler(event, context):
                     session_id = body.get('session_id')
                     message = body.get('message', '')
                     
-                    cur.execute(f"""
-                        SELECT chat_history, player_score 
-                        FROM t_p66738329_webapp_functionality.battle_sessions
-                        WHERE id = {int(session_id)}
-                    """)
-                    
-                    row = cur.fetchone()
-                    if not row:
-                        return {
-                            'statusCode': 404,
-                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                            'body': json.dumps({'error': 'Session not found'}),
-                            'isBase64Encoded': False
-                        }
-                    
-                    chat_history = json.loads(row[0]) if row[0] else []
-                    current_score = row[1]
-                    
                     points = 15
                     if len(message) > 50:
                         points += 5
@@ -300,18 +285,33 @@ def handler(event, context):
                     
                     ai_response = random.choice(ai_responses)
                     
-                    chat_history.append({'role': 'manager', 'content': message})
-                    chat_history.append({'role': 'client', 'content': ai_response})
+                    # Both messages are appended as rows; the session update hands out their sequence numbers
+                    cur.execute("""
+                        WITH session AS (
+                            UPDATE t_p66738329_webapp_functionality.battle_sessions
+                            SET player_score = player_score + %s, message_count = message_count + 2
+                            WHERE id = %s
+                            RETURNING id, message_count, player_score
+                        ),
+                        messages AS (
+                            INSERT INTO t_p66738329_webapp_functionality.battle_messages (session_id, seq, role, content)
+                            SELECT id, message_count - 1, 'manager', %s FROM session
+                            UNION ALL
+                            SELECT id, message_count, 'client', %s FROM session
+                        )
+                        SELECT player_score FROM session
+                    """, (points, int(session_id), message, ai_response))
                     
-                    new_score = current_score + points
-                    chat_json = json.dumps(chat_history).replace("'", "''")
-                    
-                    cur.execute(f"""
-                        UPDATE t_p66738329_webapp_functionality.battle_sessions
-                        SET chat_history = '{chat_json}', player_score = {new_score}
-                        WHERE id = {int(session_id)}
-                    """)
+                    row = cur.fetchone()
+                    if not row:
+                        return {
+                            'statusCode': 404,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'Session not found'}),
+                            'isBase64Encoded': False
+                        }
                     
+                    new_score = row[0]
                     conn.commit()
                     
                     return {
@@ -367,6 +367,8 @@ def handler(event, context):
                         cur.execute(f"UPDATE t_p66738329_webapp_functionality.sales_managers SET losses = losses + 1 WHERE id = {int(player_id)}")
                         cur.execute(f"UPDATE t_p66738329_webapp_functionality.sales_managers SET wins = wins + 1 WHERE id = {int(opponent_id)}")
                     
+                    cur.execute(f"SELECT t_p66738329_webapp_functionality.leaderboard_record_match({int(match_id)})")
+                    
                     conn.commit()
                     
                     return {
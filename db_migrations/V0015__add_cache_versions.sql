@@ -0,0 +1,44 @@
+-- Счетчики версий для кеширования агрегированных ответов API
+CREATE TABLE t_p66738329_webapp_functionality.cache_versions (
+    scope VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p66738329_webapp_functionality.cache_versions (scope) VALUES ('org');
+
+-- Увеличение версии области кеша (имя области передается аргументом триггера)
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.bump_cache_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE t_p66738329_webapp_functionality.cache_versions
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE scope = TG_ARGV[0];
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Структура организации: компании, подразделения, сотрудники, назначения курсов и тренажеров
+CREATE TRIGGER trg_companies_org_version
+AFTER INSERT OR UPDATE OR DELETE ON t_p66738329_webapp_functionality.companies
+FOR EACH STATEMENT EXECUTE FUNCTION t_p66738329_webapp_functionality.bump_cache_version('org');
+
+CREATE TRIGGER trg_departments_org_version
+AFTER INSERT OR UPDATE OR DELETE ON t_p66738329_webapp_functionality.departments
+FOR EACH STATEMENT EXECUTE FUNCTION t_p66738329_webapp_functionality.bump_cache_version('org');
+
+CREATE TRIGGER trg_users_org_version
+AFTER INSERT OR DELETE OR UPDATE OF company_id, department_id ON t_p66738329_webapp_functionality.users
+FOR EACH STATEMENT EXECUTE FUNCTION t_p66738329_webapp_functionality.bump_cache_version('org');
+
+CREATE TRIGGER trg_access_groups_org_version
+AFTER UPDATE OF group_name ON t_p66738329_webapp_functionality.access_groups
+FOR EACH STATEMENT EXECUTE FUNCTION t_p66738329_webapp_functionality.bump_cache_version('org');
+
+CREATE TRIGGER trg_course_departments_org_version
+AFTER INSERT OR UPDATE OR DELETE ON t_p66738329_webapp_functionality.course_departments
+FOR EACH STATEMENT EXECUTE FUNCTION t_p66738329_webapp_functionality.bump_cache_version('org');
+
+CREATE TRIGGER trg_trainer_departments_org_version
+AFTER INSERT OR UPDATE OR DELETE ON t_p66738329_webapp_functionality.trainer_departments
+FOR EACH STATEMENT EXECUTE FUNCTION t_p66738329_webapp_functionality.bump_cache_version('org');
@@ -0,0 +1,47 @@
+-- Хранилище содержимого курсов и тренажеров, разбитого на фрагменты
+CREATE TABLE t_p66738329_webapp_functionality.content_chunks (
+    item_type VARCHAR(20) NOT NULL,
+    item_id INTEGER NOT NULL,
+    chunk_no INTEGER NOT NULL,
+    section_no INTEGER NOT NULL DEFAULT 0,
+    section_title VARCHAR(255),
+    byte_offset INTEGER NOT NULL DEFAULT 0,
+    byte_length INTEGER NOT NULL DEFAULT 0,
+    chunk_hash VARCHAR(64) NOT NULL,
+    body TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (item_type, item_id, chunk_no)
+);
+
+-- Хеш и размер содержимого хранятся в карточке курса/тренажера
+ALTER TABLE t_p66738329_webapp_functionality.courses
+ADD COLUMN content_hash VARCHAR(64),
+ADD COLUMN content_length INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE t_p66738329_webapp_functionality.trainers
+ADD COLUMN content_hash VARCHAR(64),
+ADD COLUMN content_length INTEGER NOT NULL DEFAULT 0;
+
+-- Перенос существующего содержимого одним фрагментом (разбивка произойдет при следующем сохранении)
+INSERT INTO t_p66738329_webapp_functionality.content_chunks
+(item_type, item_id, chunk_no, byte_offset, byte_length, chunk_hash, body)
+SELECT 'course', id, 0, 0, octet_length(content), encode(sha256(convert_to(content, 'UTF8')), 'hex'), content
+FROM t_p66738329_webapp_functionality.courses
+WHERE content IS NOT NULL AND content <> '';
+
+INSERT INTO t_p66738329_webapp_functionality.content_chunks
+(item_type, item_id, chunk_no, byte_offset, byte_length, chunk_hash, body)
+SELECT 'trainer', id, 0, 0, octet_length(content), encode(sha256(convert_to(content, 'UTF8')), 'hex'), content
+FROM t_p66738329_webapp_functionality.trainers
+WHERE content IS NOT NULL AND content <> '';
+
+UPDATE t_p66738329_webapp_functionality.courses
+SET content_hash = encode(sha256(convert_to(COALESCE(content, ''), 'UTF8')), 'hex'),
+    content_length = octet_length(COALESCE(content, ''));
+
+UPDATE t_p66738329_webapp_functionality.trainers
+SET content_hash = encode(sha256(convert_to(COALESCE(content, ''), 'UTF8')), 'hex'),
+    content_length = octet_length(COALESCE(content, ''));
+
+ALTER TABLE t_p66738329_webapp_functionality.courses DROP COLUMN content;
+ALTER TABLE t_p66738329_webapp_functionality.trainers DROP COLUMN content;
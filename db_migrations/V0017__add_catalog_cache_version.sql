@@ -0,0 +1,11 @@
+-- Версия каталога курсов и тренажеров для перестроения индекса рекомендаций
+INSERT INTO t_p66738329_webapp_functionality.cache_versions (scope) VALUES ('catalog')
+ON CONFLICT (scope) DO NOTHING;
+
+CREATE TRIGGER trg_courses_catalog_version
+AFTER INSERT OR DELETE OR UPDATE OF title, description, duration_hours, is_active ON t_p66738329_webapp_functionality.courses
+FOR EACH STATEMENT EXECUTE FUNCTION t_p66738329_webapp_functionality.bump_cache_version('catalog');
+
+CREATE TRIGGER trg_trainers_catalog_version
+AFTER INSERT OR DELETE OR UPDATE OF title, description, difficulty_level, is_active ON t_p66738329_webapp_functionality.trainers
+FOR EACH STATEMENT EXECUTE FUNCTION t_p66738329_webapp_functionality.bump_cache_version('catalog');
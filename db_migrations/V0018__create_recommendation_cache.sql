@@ -0,0 +1,17 @@
+-- Версия набора пройденных курсов и тренажеров пользователя
+CREATE TABLE t_p66738329_webapp_functionality.user_progress_versions (
+    user_id INTEGER PRIMARY KEY REFERENCES t_p66738329_webapp_functionality.users(id),
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Кеш рассчитанных рекомендаций, действителен при совпадении версий каталога и прогресса
+CREATE TABLE t_p66738329_webapp_functionality.recommendation_cache (
+    user_id INTEGER NOT NULL REFERENCES t_p66738329_webapp_functionality.users(id),
+    mode VARCHAR(20) NOT NULL DEFAULT 'index',
+    catalog_version BIGINT NOT NULL,
+    progress_version BIGINT NOT NULL,
+    result TEXT NOT NULL,
+    computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, mode)
+);
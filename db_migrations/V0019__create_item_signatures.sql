@@ -0,0 +1,9 @@
+-- MinHash-сигнатуры курсов и тренажеров для приближенного поиска похожих (LSH)
+CREATE TABLE t_p66738329_webapp_functionality.item_signatures (
+    item_type VARCHAR(20) NOT NULL,
+    item_id INTEGER NOT NULL,
+    tokens_hash VARCHAR(64) NOT NULL,
+    signature INTEGER[] NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (item_type, item_id)
+);
@@ -0,0 +1,6 @@
+-- Нормализованные термины (основы слов с количеством) названия и описания для рекомендаций
+ALTER TABLE t_p66738329_webapp_functionality.courses
+ADD COLUMN terms JSONB;
+
+ALTER TABLE t_p66738329_webapp_functionality.trainers
+ADD COLUMN terms JSONB;
@@ -0,0 +1,14 @@
+-- Буфер промежуточного процента прохождения: хранится только последнее значение по пользователю и элементу,
+-- в основные таблицы переносится пакетно; таблица нежурналируемая, потеря при сбое допустима
+CREATE UNLOGGED TABLE t_p66738329_webapp_functionality.progress_staging (
+    user_id INTEGER NOT NULL,
+    item_type VARCHAR(20) NOT NULL,
+    item_id INTEGER NOT NULL,
+    status VARCHAR(50) NOT NULL,
+    progress_percent INTEGER NOT NULL DEFAULT 0,
+    buffered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, item_type, item_id)
+);
+
+CREATE INDEX idx_progress_staging_buffered_at ON t_p66738329_webapp_functionality.progress_staging(buffered_at);
@@ -0,0 +1,58 @@
+-- Журнал событий обучения (только добавление), секционирован по месяцам
+CREATE TABLE t_p66738329_webapp_functionality.learning_events (
+    id BIGSERIAL,
+    user_id INTEGER NOT NULL,
+    item_type VARCHAR(20) NOT NULL,
+    item_id INTEGER NOT NULL,
+    event_type VARCHAR(20) NOT NULL,
+    status VARCHAR(50),
+    progress_percent INTEGER,
+    occurred_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, occurred_at)
+) PARTITION BY RANGE (occurred_at);
+
+CREATE INDEX idx_learning_events_occurred_at ON t_p66738329_webapp_functionality.learning_events(occurred_at);
+
+-- Секция на месяц, содержащий указанную дату (имя learning_events_ГГГГММ)
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.create_learning_events_partition(month_start DATE)
+RETURNS VOID AS $$
+DECLARE
+    from_date DATE := date_trunc('month', month_start)::DATE;
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS t_p66738329_webapp_functionality.%I PARTITION OF t_p66738329_webapp_functionality.learning_events FOR VALUES FROM (%L) TO (%L)',
+        'learning_events_' || to_char(from_date, 'YYYYMM'), from_date, (from_date + INTERVAL '1 month')::DATE
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT t_p66738329_webapp_functionality.create_learning_events_partition(CURRENT_DATE::DATE);
+SELECT t_p66738329_webapp_functionality.create_learning_events_partition((CURRENT_DATE + INTERVAL '1 month')::DATE);
+
+-- Подстраховка на случай, если задание сжатия не создало секцию заранее
+CREATE TABLE t_p66738329_webapp_functionality.learning_events_default
+PARTITION OF t_p66738329_webapp_functionality.learning_events DEFAULT;
+
+-- Дневные итоги по пользователю и элементу: число событий, время занятий, максимальный процент
+CREATE TABLE t_p66738329_webapp_functionality.learning_daily_rollups (
+    day DATE NOT NULL,
+    user_id INTEGER NOT NULL,
+    item_type VARCHAR(20) NOT NULL,
+    item_id INTEGER NOT NULL,
+    events_count INTEGER NOT NULL DEFAULT 0,
+    active_seconds INTEGER NOT NULL DEFAULT 0,
+    max_percent INTEGER NOT NULL DEFAULT 0,
+    completed BOOLEAN NOT NULL DEFAULT FALSE,
+    PRIMARY KEY (day, user_id, item_type, item_id)
+);
+
+CREATE INDEX idx_learning_daily_rollups_user ON t_p66738329_webapp_functionality.learning_daily_rollups(user_id, day);
+
+-- Граница уже свернутых событий
+CREATE TABLE t_p66738329_webapp_functionality.learning_events_compaction (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    compacted_until TIMESTAMP NOT NULL DEFAULT '1970-01-01',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p66738329_webapp_functionality.learning_events_compaction (id) VALUES (1);
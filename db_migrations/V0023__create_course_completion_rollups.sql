@@ -0,0 +1,191 @@
+-- Сводка прохождения курсов по подразделениям и компаниям: назначено, начато, завершено, сумма процентов
+CREATE TABLE t_p66738329_webapp_functionality.department_course_rollups (
+    department_id INTEGER NOT NULL,
+    course_id INTEGER NOT NULL,
+    assigned INTEGER NOT NULL DEFAULT 0,
+    started INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    percent_sum BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (department_id, course_id)
+);
+
+CREATE TABLE t_p66738329_webapp_functionality.company_course_rollups (
+    company_id INTEGER NOT NULL,
+    course_id INTEGER NOT NULL,
+    assigned INTEGER NOT NULL DEFAULT 0,
+    started INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    percent_sum BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (company_id, course_id)
+);
+
+-- Прибавление приращений к строкам подразделения и компании
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.add_course_rollup(
+    p_department_id INTEGER, p_company_id INTEGER, p_course_id INTEGER,
+    d_assigned INTEGER, d_started INTEGER, d_completed INTEGER, d_percent INTEGER
+) RETURNS VOID AS $$
+BEGIN
+    IF d_assigned = 0 AND d_started = 0 AND d_completed = 0 AND d_percent = 0 THEN
+        RETURN;
+    END IF;
+    IF p_department_id IS NOT NULL THEN
+        INSERT INTO t_p66738329_webapp_functionality.department_course_rollups AS r
+            (department_id, course_id, assigned, started, completed, percent_sum)
+        VALUES (p_department_id, p_course_id, d_assigned, d_started, d_completed, d_percent)
+        ON CONFLICT (department_id, course_id) DO UPDATE SET
+            assigned = r.assigned + EXCLUDED.assigned,
+            started = r.started + EXCLUDED.started,
+            completed = r.completed + EXCLUDED.completed,
+            percent_sum = r.percent_sum + EXCLUDED.percent_sum,
+            updated_at = CURRENT_TIMESTAMP;
+    END IF;
+    IF p_company_id IS NOT NULL THEN
+        INSERT INTO t_p66738329_webapp_functionality.company_course_rollups AS r
+            (company_id, course_id, assigned, started, completed, percent_sum)
+        VALUES (p_company_id, p_course_id, d_assigned, d_started, d_completed, d_percent)
+        ON CONFLICT (company_id, course_id) DO UPDATE SET
+            assigned = r.assigned + EXCLUDED.assigned,
+            started = r.started + EXCLUDED.started,
+            completed = r.completed + EXCLUDED.completed,
+            percent_sum = r.percent_sum + EXCLUDED.percent_sum,
+            updated_at = CURRENT_TIMESTAMP;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Изменение прогресса сотрудника: вычитается старый вклад строки, прибавляется новый
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.course_progress_rollup()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_department_id INTEGER;
+    v_company_id INTEGER;
+BEGIN
+    SELECT department_id, company_id INTO v_department_id, v_company_id
+    FROM t_p66738329_webapp_functionality.users
+    WHERE id = CASE WHEN TG_OP = 'DELETE' THEN OLD.user_id ELSE NEW.user_id END;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM t_p66738329_webapp_functionality.add_course_rollup(
+            v_department_id, v_company_id, OLD.course_id, 0,
+            -(OLD.status IN ('in_progress', 'completed'))::int, -(OLD.status = 'completed')::int, -COALESCE(OLD.progress_percent, 0));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM t_p66738329_webapp_functionality.add_course_rollup(
+            v_department_id, v_company_id, NEW.course_id, 0,
+            (NEW.status IN ('in_progress', 'completed'))::int, (NEW.status = 'completed')::int, COALESCE(NEW.progress_percent, 0));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_course_progress_rollup
+AFTER INSERT OR DELETE OR UPDATE OF status, progress_percent ON t_p66738329_webapp_functionality.course_progress
+FOR EACH ROW EXECUTE FUNCTION t_p66738329_webapp_functionality.course_progress_rollup();
+
+-- Назначение курса подразделению: назначено всем его сотрудникам
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.course_departments_rollup()
+RETURNS TRIGGER AS $$
+DECLARE
+    r RECORD;
+    v_sign INTEGER := CASE WHEN TG_OP = 'DELETE' THEN -1 ELSE 1 END;
+    v_link RECORD;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        v_link := OLD;
+    ELSE
+        v_link := NEW;
+    END IF;
+    FOR r IN
+        SELECT company_id, COUNT(*)::int as headcount
+        FROM t_p66738329_webapp_functionality.users
+        WHERE department_id = v_link.department_id
+        GROUP BY company_id
+    LOOP
+        PERFORM t_p66738329_webapp_functionality.add_course_rollup(
+            v_link.department_id, r.company_id, v_link.course_id, v_sign * r.headcount, 0, 0, 0);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_course_departments_rollup
+AFTER INSERT OR DELETE ON t_p66738329_webapp_functionality.course_departments
+FOR EACH ROW EXECUTE FUNCTION t_p66738329_webapp_functionality.course_departments_rollup();
+
+-- Перевод сотрудника: его назначения и прогресс переходят из старых подразделения/компании в новые
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.users_course_rollup()
+RETURNS TRIGGER AS $$
+DECLARE
+    r RECORD;
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.department_id IS NOT DISTINCT FROM NEW.department_id AND OLD.company_id IS NOT DISTINCT FROM NEW.company_id THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'UPDATE' THEN
+        FOR r IN SELECT course_id FROM t_p66738329_webapp_functionality.course_departments WHERE department_id = OLD.department_id LOOP
+            PERFORM t_p66738329_webapp_functionality.add_course_rollup(OLD.department_id, OLD.company_id, r.course_id, -1, 0, 0, 0);
+        END LOOP;
+        FOR r IN SELECT course_id, status, progress_percent FROM t_p66738329_webapp_functionality.course_progress WHERE user_id = OLD.id LOOP
+            PERFORM t_p66738329_webapp_functionality.add_course_rollup(
+                OLD.department_id, OLD.company_id, r.course_id, 0,
+                -(r.status IN ('in_progress', 'completed'))::int, -(r.status = 'completed')::int, -COALESCE(r.progress_percent, 0));
+        END LOOP;
+    END IF;
+
+    FOR r IN SELECT course_id FROM t_p66738329_webapp_functionality.course_departments WHERE department_id = NEW.department_id LOOP
+        PERFORM t_p66738329_webapp_functionality.add_course_rollup(NEW.department_id, NEW.company_id, r.course_id, 1, 0, 0, 0);
+    END LOOP;
+    FOR r IN SELECT course_id, status, progress_percent FROM t_p66738329_webapp_functionality.course_progress WHERE user_id = NEW.id LOOP
+        PERFORM t_p66738329_webapp_functionality.add_course_rollup(
+            NEW.department_id, NEW.company_id, r.course_id, 0,
+            (r.status IN ('in_progress', 'completed'))::int, (r.status = 'completed')::int, COALESCE(r.progress_percent, 0));
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_users_course_rollup
+AFTER INSERT OR UPDATE OF department_id, company_id ON t_p66738329_webapp_functionality.users
+FOR EACH ROW EXECUTE FUNCTION t_p66738329_webapp_functionality.users_course_rollup();
+
+-- Начальное заполнение по текущим данным
+INSERT INTO t_p66738329_webapp_functionality.department_course_rollups (department_id, course_id, assigned, started, completed, percent_sum)
+SELECT cd.department_id, cd.course_id,
+       (SELECT COUNT(*) FROM t_p66738329_webapp_functionality.users u WHERE u.department_id = cd.department_id),
+       0, 0, 0
+FROM t_p66738329_webapp_functionality.course_departments cd
+ON CONFLICT (department_id, course_id) DO NOTHING;
+
+INSERT INTO t_p66738329_webapp_functionality.department_course_rollups AS r (department_id, course_id, started, completed, percent_sum)
+SELECT u.department_id, cp.course_id,
+       COUNT(*) FILTER (WHERE cp.status IN ('in_progress', 'completed')),
+       COUNT(*) FILTER (WHERE cp.status = 'completed'),
+       COALESCE(SUM(cp.progress_percent), 0)
+FROM t_p66738329_webapp_functionality.course_progress cp
+INNER JOIN t_p66738329_webapp_functionality.users u ON u.id = cp.user_id
+WHERE u.department_id IS NOT NULL
+GROUP BY u.department_id, cp.course_id
+ON CONFLICT (department_id, course_id) DO UPDATE SET
+    started = EXCLUDED.started, completed = EXCLUDED.completed, percent_sum = EXCLUDED.percent_sum;
+
+INSERT INTO t_p66738329_webapp_functionality.company_course_rollups (company_id, course_id, assigned)
+SELECT u.company_id, cd.course_id, COUNT(*)
+FROM t_p66738329_webapp_functionality.course_departments cd
+INNER JOIN t_p66738329_webapp_functionality.users u ON u.department_id = cd.department_id
+WHERE u.company_id IS NOT NULL
+GROUP BY u.company_id, cd.course_id;
+
+INSERT INTO t_p66738329_webapp_functionality.company_course_rollups AS r (company_id, course_id, started, completed, percent_sum)
+SELECT u.company_id, cp.course_id,
+       COUNT(*) FILTER (WHERE cp.status IN ('in_progress', 'completed')),
+       COUNT(*) FILTER (WHERE cp.status = 'completed'),
+       COALESCE(SUM(cp.progress_percent), 0)
+FROM t_p66738329_webapp_functionality.course_progress cp
+INNER JOIN t_p66738329_webapp_functionality.users u ON u.id = cp.user_id
+WHERE u.company_id IS NOT NULL
+GROUP BY u.company_id, cp.course_id
+ON CONFLICT (company_id, course_id) DO UPDATE SET
+    started = EXCLUDED.started, completed = EXCLUDED.completed, percent_sum = EXCLUDED.percent_sum;
@@ -0,0 +1,25 @@
+-- Попытки прохождения тренажеров: результат и длительность каждой попытки
+CREATE TABLE t_p66738329_webapp_functionality.trainer_attempts (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES t_p66738329_webapp_functionality.users(id),
+    trainer_id INTEGER NOT NULL REFERENCES t_p66738329_webapp_functionality.trainers(id),
+    score INTEGER NOT NULL,
+    duration_seconds INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_trainer_attempts_user_trainer ON t_p66738329_webapp_functionality.trainer_attempts(user_id, trainer_id, created_at);
+
+-- Распределение результатов по тренажеру: корзины по 10 баллов (последняя 90-100)
+CREATE TABLE t_p66738329_webapp_functionality.trainer_score_histogram (
+    trainer_id INTEGER NOT NULL,
+    bucket SMALLINT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    score_sum BIGINT NOT NULL DEFAULT 0,
+    duration_sum BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (trainer_id, bucket)
+);
+
+-- Рейтинг по тренажеру читается по индексу лучших результатов
+CREATE INDEX idx_trainer_progress_best_score ON t_p66738329_webapp_functionality.trainer_progress(trainer_id, best_score DESC)
+WHERE attempts_count > 0;
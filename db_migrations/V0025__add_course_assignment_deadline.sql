@@ -0,0 +1,3 @@
+-- Срок прохождения курса, назначенного подразделению
+ALTER TABLE t_p66738329_webapp_functionality.course_departments
+ADD COLUMN deadline DATE;
@@ -0,0 +1,45 @@
+-- Полнотекстовый поиск по курсам и тренажерам: название (A) > описание (B) > содержимое (C).
+-- Содержимое хранится во фрагментах, поэтому его вектор ведет приложение при сохранении,
+-- а итоговый взвешенный вектор - генерируемый столбец
+ALTER TABLE t_p66738329_webapp_functionality.courses
+ADD COLUMN content_vector TSVECTOR;
+
+ALTER TABLE t_p66738329_webapp_functionality.trainers
+ADD COLUMN content_vector TSVECTOR;
+
+UPDATE t_p66738329_webapp_functionality.courses c
+SET content_vector = to_tsvector('russian', left(cc.body, 102400))
+FROM (
+    SELECT item_id, string_agg(body, '' ORDER BY chunk_no) as body
+    FROM t_p66738329_webapp_functionality.content_chunks
+    WHERE item_type = 'course'
+    GROUP BY item_id
+) cc
+WHERE cc.item_id = c.id;
+
+UPDATE t_p66738329_webapp_functionality.trainers t
+SET content_vector = to_tsvector('russian', left(cc.body, 102400))
+FROM (
+    SELECT item_id, string_agg(body, '' ORDER BY chunk_no) as body
+    FROM t_p66738329_webapp_functionality.content_chunks
+    WHERE item_type = 'trainer'
+    GROUP BY item_id
+) cc
+WHERE cc.item_id = t.id;
+
+ALTER TABLE t_p66738329_webapp_functionality.courses
+ADD COLUMN search_vector TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', COALESCE(title, '')), 'A') ||
+    setweight(to_tsvector('russian', COALESCE(description, '')), 'B') ||
+    setweight(COALESCE(content_vector, ''::tsvector), 'C')
+) STORED;
+
+ALTER TABLE t_p66738329_webapp_functionality.trainers
+ADD COLUMN search_vector TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', COALESCE(title, '')), 'A') ||
+    setweight(to_tsvector('russian', COALESCE(description, '')), 'B') ||
+    setweight(COALESCE(content_vector, ''::tsvector), 'C')
+) STORED;
+
+CREATE INDEX idx_courses_search_vector ON t_p66738329_webapp_functionality.courses USING GIN (search_vector);
+CREATE INDEX idx_trainers_search_vector ON t_p66738329_webapp_functionality.trainers USING GIN (search_vector);
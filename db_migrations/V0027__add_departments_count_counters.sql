@@ -0,0 +1,59 @@
+-- Счетчик подразделений, которым назначен курс/тренажер, ведется триггерами на таблицах назначений
+ALTER TABLE t_p66738329_webapp_functionality.courses
+ADD COLUMN departments_count INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE t_p66738329_webapp_functionality.trainers
+ADD COLUMN departments_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE t_p66738329_webapp_functionality.courses c
+SET departments_count = (SELECT COUNT(*) FROM t_p66738329_webapp_functionality.course_departments cd WHERE cd.course_id = c.id);
+
+UPDATE t_p66738329_webapp_functionality.trainers t
+SET departments_count = (SELECT COUNT(*) FROM t_p66738329_webapp_functionality.trainer_departments td WHERE td.trainer_id = t.id);
+
+-- Один UPDATE на оператор по таблице переходов, а не на каждую строку назначения
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.count_course_departments()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE t_p66738329_webapp_functionality.courses c
+    SET departments_count = c.departments_count + CASE WHEN TG_OP = 'DELETE' THEN -ch.links ELSE ch.links END
+    FROM (SELECT course_id, COUNT(*)::int as links FROM changed GROUP BY course_id) ch
+    WHERE c.id = ch.course_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.count_trainer_departments()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE t_p66738329_webapp_functionality.trainers t
+    SET departments_count = t.departments_count + CASE WHEN TG_OP = 'DELETE' THEN -ch.links ELSE ch.links END
+    FROM (SELECT trainer_id, COUNT(*)::int as links FROM changed GROUP BY trainer_id) ch
+    WHERE t.id = ch.trainer_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_course_departments_count_insert
+AFTER INSERT ON t_p66738329_webapp_functionality.course_departments
+REFERENCING NEW TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION t_p66738329_webapp_functionality.count_course_departments();
+
+CREATE TRIGGER trg_course_departments_count_delete
+AFTER DELETE ON t_p66738329_webapp_functionality.course_departments
+REFERENCING OLD TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION t_p66738329_webapp_functionality.count_course_departments();
+
+CREATE TRIGGER trg_trainer_departments_count_insert
+AFTER INSERT ON t_p66738329_webapp_functionality.trainer_departments
+REFERENCING NEW TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION t_p66738329_webapp_functionality.count_trainer_departments();
+
+CREATE TRIGGER trg_trainer_departments_count_delete
+AFTER DELETE ON t_p66738329_webapp_functionality.trainer_departments
+REFERENCING OLD TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION t_p66738329_webapp_functionality.count_trainer_departments();
+
+-- Постраничный вывод списков по (created_at, id)
+CREATE INDEX idx_courses_created_at_id ON t_p66738329_webapp_functionality.courses(created_at DESC, id DESC);
+CREATE INDEX idx_trainers_created_at_id ON t_p66738329_webapp_functionality.trainers(created_at DESC, id DESC);
@@ -0,0 +1,151 @@
+-- Рейтинги менеджеров по продажам: общий (scope_id = 0), по компании и по турниру.
+-- points - ключ сортировки: для общего и компании level * 1000000 + wins, для турнира wins * 1000000 + очки в турнире
+CREATE TABLE t_p66738329_webapp_functionality.leaderboard_entries (
+    scope VARCHAR(20) NOT NULL,
+    scope_id INTEGER NOT NULL DEFAULT 0,
+    manager_id INTEGER NOT NULL REFERENCES t_p66738329_webapp_functionality.sales_managers(id),
+    points BIGINT NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    score INTEGER NOT NULL DEFAULT 0,
+    rank INTEGER NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (scope, scope_id, manager_id)
+);
+
+CREATE INDEX idx_leaderboard_entries_rank ON t_p66738329_webapp_functionality.leaderboard_entries(scope, scope_id, rank, manager_id);
+CREATE INDEX idx_leaderboard_entries_points ON t_p66738329_webapp_functionality.leaderboard_entries(scope, scope_id, points DESC);
+
+-- Обновление одной записи рейтинга. Место меняется только у записей между старым и новым ключом:
+-- их место = число записей выше этого диапазона + RANK() внутри диапазона
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.leaderboard_apply(
+    p_scope VARCHAR, p_scope_id INTEGER, p_manager_id INTEGER,
+    p_points BIGINT, p_wins INTEGER, p_losses INTEGER, p_score INTEGER
+) RETURNS VOID AS $$
+DECLARE
+    v_old_points BIGINT;
+    v_high BIGINT;
+    v_low BIGINT;
+    v_above INTEGER;
+BEGIN
+    -- Одновременные пересчеты одного рейтинга выполняются по очереди
+    PERFORM pg_advisory_xact_lock(hashtext('leaderboard:' || p_scope || ':' || p_scope_id));
+
+    SELECT points INTO v_old_points
+    FROM t_p66738329_webapp_functionality.leaderboard_entries
+    WHERE scope = p_scope AND scope_id = p_scope_id AND manager_id = p_manager_id;
+
+    INSERT INTO t_p66738329_webapp_functionality.leaderboard_entries AS e
+        (scope, scope_id, manager_id, points, wins, losses, score)
+    VALUES (p_scope, p_scope_id, p_manager_id, p_points, p_wins, p_losses, p_score)
+    ON CONFLICT (scope, scope_id, manager_id) DO UPDATE SET
+        points = EXCLUDED.points,
+        wins = EXCLUDED.wins,
+        losses = EXCLUDED.losses,
+        score = EXCLUDED.score,
+        updated_at = CURRENT_TIMESTAMP;
+
+    IF v_old_points = p_points THEN
+        RETURN;
+    END IF;
+
+    -- Новая запись сдвигает все записи ниже себя
+    v_high := GREATEST(p_points, COALESCE(v_old_points, p_points));
+    v_low := CASE WHEN v_old_points IS NULL THEN NULL ELSE LEAST(p_points, v_old_points) END;
+
+    SELECT COUNT(*) INTO v_above
+    FROM t_p66738329_webapp_functionality.leaderboard_entries
+    WHERE scope = p_scope AND scope_id = p_scope_id AND points > v_high;
+
+    UPDATE t_p66738329_webapp_functionality.leaderboard_entries e
+    SET rank = s.rank
+    FROM (
+        SELECT manager_id, v_above + RANK() OVER (ORDER BY points DESC) as rank
+        FROM t_p66738329_webapp_functionality.leaderboard_entries
+        WHERE scope = p_scope AND scope_id = p_scope_id
+          AND points <= v_high AND (v_low IS NULL OR points >= v_low)
+    ) s
+    WHERE e.scope = p_scope AND e.scope_id = p_scope_id AND e.manager_id = s.manager_id AND e.rank <> s.rank;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Общий рейтинг и рейтинг компании менеджера по его текущей статистике
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.leaderboard_refresh_manager(p_manager_id INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    m RECORD;
+BEGIN
+    SELECT id, company_id, COALESCE(level, 1) as level, COALESCE(wins, 0) as wins,
+           COALESCE(losses, 0) as losses, COALESCE(total_score, 0) as total_score
+    INTO m
+    FROM t_p66738329_webapp_functionality.sales_managers
+    WHERE id = p_manager_id;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    PERFORM t_p66738329_webapp_functionality.leaderboard_apply(
+        'global', 0, m.id, m.level::bigint * 1000000 + m.wins, m.wins, m.losses, m.total_score);
+    PERFORM t_p66738329_webapp_functionality.leaderboard_apply(
+        'company', m.company_id, m.id, m.level::bigint * 1000000 + m.wins, m.wins, m.losses, m.total_score);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Завершение матча: обновляются общий, компанейский и турнирный рейтинги обоих участников
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.leaderboard_record_match(p_match_id INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    v_tournament_id INTEGER;
+    v_manager_id INTEGER;
+    t RECORD;
+BEGIN
+    FOR v_tournament_id, v_manager_id IN
+        SELECT tm.tournament_id, p.id
+        FROM t_p66738329_webapp_functionality.tournament_matches tm
+        CROSS JOIN LATERAL (VALUES (tm.player1_id), (tm.player2_id)) AS p(id)
+        WHERE tm.id = p_match_id AND p.id IS NOT NULL
+    LOOP
+        PERFORM t_p66738329_webapp_functionality.leaderboard_refresh_manager(v_manager_id);
+
+        SELECT COUNT(*) FILTER (WHERE winner_id = v_manager_id)::int as wins,
+               COUNT(*) FILTER (WHERE winner_id IS DISTINCT FROM v_manager_id)::int as losses,
+               COALESCE(SUM(CASE WHEN player1_id = v_manager_id THEN score1 ELSE score2 END), 0)::int as score
+        INTO t
+        FROM t_p66738329_webapp_functionality.tournament_matches
+        WHERE tournament_id = v_tournament_id AND status = 'completed'
+          AND (player1_id = v_manager_id OR player2_id = v_manager_id);
+
+        PERFORM t_p66738329_webapp_functionality.leaderboard_apply(
+            'tournament', v_tournament_id, v_manager_id, t.wins::bigint * 1000000 + t.score, t.wins, t.losses, t.score);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Начальное заполнение: места считаются оконной функцией по каждому рейтингу
+INSERT INTO t_p66738329_webapp_functionality.leaderboard_entries (scope, scope_id, manager_id, points, wins, losses, score)
+SELECT 'global', 0, id, COALESCE(level, 1)::bigint * 1000000 + COALESCE(wins, 0), COALESCE(wins, 0), COALESCE(losses, 0), COALESCE(total_score, 0)
+FROM t_p66738329_webapp_functionality.sales_managers
+WHERE status = 'active'
+UNION ALL
+SELECT 'company', company_id, id, COALESCE(level, 1)::bigint * 1000000 + COALESCE(wins, 0), COALESCE(wins, 0), COALESCE(losses, 0), COALESCE(total_score, 0)
+FROM t_p66738329_webapp_functionality.sales_managers
+WHERE status = 'active';
+
+INSERT INTO t_p66738329_webapp_functionality.leaderboard_entries (scope, scope_id, manager_id, points, wins, losses, score)
+SELECT 'tournament', tm.tournament_id, p.id,
+       COUNT(*) FILTER (WHERE tm.winner_id = p.id)::bigint * 1000000 + COALESCE(SUM(CASE WHEN tm.player1_id = p.id THEN tm.score1 ELSE tm.score2 END), 0),
+       COUNT(*) FILTER (WHERE tm.winner_id = p.id),
+       COUNT(*) FILTER (WHERE tm.winner_id IS DISTINCT FROM p.id),
+       COALESCE(SUM(CASE WHEN tm.player1_id = p.id THEN tm.score1 ELSE tm.score2 END), 0)
+FROM t_p66738329_webapp_functionality.tournament_matches tm
+CROSS JOIN LATERAL (VALUES (tm.player1_id), (tm.player2_id)) AS p(id)
+WHERE tm.status = 'completed' AND p.id IS NOT NULL
+GROUP BY tm.tournament_id, p.id;
+
+UPDATE t_p66738329_webapp_functionality.leaderboard_entries e
+SET rank = r.rank
+FROM (
+    SELECT scope, scope_id, manager_id, RANK() OVER (PARTITION BY scope, scope_id ORDER BY points DESC) as rank
+    FROM t_p66738329_webapp_functionality.leaderboard_entries
+) r
+WHERE e.scope = r.scope AND e.scope_id = r.scope_id AND e.manager_id = r.manager_id;
@@ -0,0 +1,28 @@
+-- Сообщения поединков отдельными строками вместо перезаписи всего chat_history
+CREATE TABLE t_p66738329_webapp_functionality.battle_messages (
+    session_id INTEGER NOT NULL REFERENCES t_p66738329_webapp_functionality.battle_sessions(id),
+    seq INTEGER NOT NULL,
+    role VARCHAR(20) NOT NULL,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (session_id, seq)
+);
+
+-- Номер последнего сообщения сессии; увеличивается тем же UPDATE, что и счет, и выдает номера новых сообщений
+ALTER TABLE t_p66738329_webapp_functionality.battle_sessions
+ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0;
+
+INSERT INTO t_p66738329_webapp_functionality.battle_messages (session_id, seq, role, content, created_at)
+SELECT bs.id, m.seq, COALESCE(m.value->>'role', 'client'), COALESCE(m.value->>'content', ''),
+       COALESCE((m.value->>'timestamp')::timestamp, bs.created_at)
+FROM t_p66738329_webapp_functionality.battle_sessions bs
+CROSS JOIN LATERAL jsonb_array_elements(COALESCE(bs.chat_history::jsonb, '[]'::jsonb)) WITH ORDINALITY AS m(value, seq);
+
+UPDATE t_p66738329_webapp_functionality.battle_sessions bs
+SET message_count = m.messages, chat_history = '[]'
+FROM (
+    SELECT session_id, MAX(seq) as messages
+    FROM t_p66738329_webapp_functionality.battle_messages
+    GROUP BY session_id
+) m
+WHERE m.session_id = bs.id;
@@ -0,0 +1,59 @@
+-- Версии турниров, матчей и сессий поединков для ленты изменений (long-poll).
+-- Каждое изменение увеличивает версию и отправляет NOTIFY в канал tournament_<id> / battle_<id>
+ALTER TABLE t_p66738329_webapp_functionality.tournaments
+ADD COLUMN version BIGINT NOT NULL DEFAULT 0;
+
+ALTER TABLE t_p66738329_webapp_functionality.tournament_matches
+ADD COLUMN version BIGINT NOT NULL DEFAULT 0;
+
+ALTER TABLE t_p66738329_webapp_functionality.battle_sessions
+ADD COLUMN version BIGINT NOT NULL DEFAULT 0;
+
+CREATE INDEX idx_tournament_matches_version ON t_p66738329_webapp_functionality.tournament_matches(tournament_id, version);
+
+-- Матч получает новую версию турнира; по ней клиент забирает только изменившиеся матчи
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.tournament_match_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE t_p66738329_webapp_functionality.tournaments
+    SET version = version + 1
+    WHERE id = NEW.tournament_id
+    RETURNING version INTO NEW.version;
+    PERFORM pg_notify('tournament_' || NEW.tournament_id, NEW.version::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_tournament_matches_version
+BEFORE INSERT OR UPDATE ON t_p66738329_webapp_functionality.tournament_matches
+FOR EACH ROW EXECUTE FUNCTION t_p66738329_webapp_functionality.tournament_match_version();
+
+-- Собственные изменения турнира (статус, победитель); версию, выставленную триггером матча, не трогает
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.tournament_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    PERFORM pg_notify('tournament_' || NEW.id, NEW.version::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_tournaments_version
+BEFORE UPDATE ON t_p66738329_webapp_functionality.tournaments
+FOR EACH ROW
+WHEN (NEW.version = OLD.version)
+EXECUTE FUNCTION t_p66738329_webapp_functionality.tournament_version();
+
+-- Любое изменение сессии, в том числе новое сообщение (message_count), увеличивает ее версию
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.battle_session_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    PERFORM pg_notify('battle_' || NEW.id, NEW.version::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_battle_sessions_version
+BEFORE UPDATE ON t_p66738329_webapp_functionality.battle_sessions
+FOR EACH ROW EXECUTE FUNCTION t_p66738329_webapp_functionality.battle_session_version();
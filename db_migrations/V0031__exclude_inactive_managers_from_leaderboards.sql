@@ -0,0 +1,130 @@
+-- Неактивные менеджеры не занимают места в рейтингах
+-- Удаление записи: все записи ниже нее поднимаются на одно место
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.leaderboard_remove(
+    p_scope VARCHAR, p_scope_id INTEGER, p_manager_id INTEGER
+) RETURNS VOID AS $$
+DECLARE
+    v_points BIGINT;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('leaderboard:' || p_scope || ':' || p_scope_id));
+
+    DELETE FROM t_p66738329_webapp_functionality.leaderboard_entries
+    WHERE scope = p_scope AND scope_id = p_scope_id AND manager_id = p_manager_id
+    RETURNING points INTO v_points;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    UPDATE t_p66738329_webapp_functionality.leaderboard_entries
+    SET rank = rank - 1
+    WHERE scope = p_scope AND scope_id = p_scope_id AND points < v_points;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Турнирная запись одного менеджера по его завершенным матчам турнира
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.leaderboard_refresh_tournament(p_tournament_id INTEGER, p_manager_id INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    t RECORD;
+BEGIN
+    SELECT COUNT(*) FILTER (WHERE winner_id = p_manager_id)::int as wins,
+           COUNT(*) FILTER (WHERE winner_id IS DISTINCT FROM p_manager_id)::int as losses,
+           COALESCE(SUM(CASE WHEN player1_id = p_manager_id THEN score1 ELSE score2 END), 0)::int as score
+    INTO t
+    FROM t_p66738329_webapp_functionality.tournament_matches
+    WHERE tournament_id = p_tournament_id AND status = 'completed'
+      AND (player1_id = p_manager_id OR player2_id = p_manager_id);
+
+    PERFORM t_p66738329_webapp_functionality.leaderboard_apply(
+        'tournament', p_tournament_id, p_manager_id, t.wins::bigint * 1000000 + t.score, t.wins, t.losses, t.score);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Общий рейтинг и рейтинг компании; неактивный менеджер удаляется из всех рейтингов
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.leaderboard_refresh_manager(p_manager_id INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    m RECORD;
+    e RECORD;
+BEGIN
+    SELECT id, company_id, status, COALESCE(level, 1) as level, COALESCE(wins, 0) as wins,
+           COALESCE(losses, 0) as losses, COALESCE(total_score, 0) as total_score
+    INTO m
+    FROM t_p66738329_webapp_functionality.sales_managers
+    WHERE id = p_manager_id;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    IF m.status IS DISTINCT FROM 'active' THEN
+        FOR e IN
+            SELECT scope, scope_id FROM t_p66738329_webapp_functionality.leaderboard_entries WHERE manager_id = m.id
+        LOOP
+            PERFORM t_p66738329_webapp_functionality.leaderboard_remove(e.scope, e.scope_id, m.id);
+        END LOOP;
+        RETURN;
+    END IF;
+
+    PERFORM t_p66738329_webapp_functionality.leaderboard_apply(
+        'global', 0, m.id, m.level::bigint * 1000000 + m.wins, m.wins, m.losses, m.total_score);
+    PERFORM t_p66738329_webapp_functionality.leaderboard_apply(
+        'company', m.company_id, m.id, m.level::bigint * 1000000 + m.wins, m.wins, m.losses, m.total_score);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.leaderboard_record_match(p_match_id INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    v_tournament_id INTEGER;
+    v_manager_id INTEGER;
+BEGIN
+    FOR v_tournament_id, v_manager_id IN
+        SELECT tm.tournament_id, p.id
+        FROM t_p66738329_webapp_functionality.tournament_matches tm
+        CROSS JOIN LATERAL (VALUES (tm.player1_id), (tm.player2_id)) AS p(id)
+        INNER JOIN t_p66738329_webapp_functionality.sales_managers sm ON sm.id = p.id
+        WHERE tm.id = p_match_id AND sm.status = 'active'
+    LOOP
+        PERFORM t_p66738329_webapp_functionality.leaderboard_refresh_manager(v_manager_id);
+        PERFORM t_p66738329_webapp_functionality.leaderboard_refresh_tournament(v_tournament_id, v_manager_id);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Смена статуса менеджера: деактивация убирает его из рейтингов, повторная активация возвращает
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.leaderboard_manager_status()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_tournament_id INTEGER;
+BEGIN
+    PERFORM t_p66738329_webapp_functionality.leaderboard_refresh_manager(NEW.id);
+    IF NEW.status = 'active' THEN
+        FOR v_tournament_id IN
+            SELECT DISTINCT tournament_id FROM t_p66738329_webapp_functionality.tournament_matches
+            WHERE status = 'completed' AND (player1_id = NEW.id OR player2_id = NEW.id)
+        LOOP
+            PERFORM t_p66738329_webapp_functionality.leaderboard_refresh_tournament(v_tournament_id, NEW.id);
+        END LOOP;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_sales_managers_leaderboard_status
+AFTER UPDATE OF status ON t_p66738329_webapp_functionality.sales_managers
+FOR EACH ROW
+WHEN (OLD.status IS DISTINCT FROM NEW.status)
+EXECUTE FUNCTION t_p66738329_webapp_functionality.leaderboard_manager_status();
+
+-- Записи уже неактивных менеджеров удаляются, места пересчитываются заново
+DELETE FROM t_p66738329_webapp_functionality.leaderboard_entries e
+USING t_p66738329_webapp_functionality.sales_managers sm
+WHERE sm.id = e.manager_id AND sm.status IS DISTINCT FROM 'active';
+
+UPDATE t_p66738329_webapp_functionality.leaderboard_entries e
+SET rank = r.rank
+FROM (
+    SELECT scope, scope_id, manager_id, RANK() OVER (PARTITION BY scope, scope_id ORDER BY points DESC) as rank
+    FROM t_p66738329_webapp_functionality.leaderboard_entries
+) r
+WHERE e.scope = r.scope AND e.scope_id = r.scope_id AND e.manager_id = r.manager_id AND e.rank <> r.rank;
@@ -0,0 +1,33 @@
+-- Создание секции learning_events, когда секция по умолчанию уже содержит строки ее месяца:
+-- такие строки переносятся в новую секцию вместо ошибки CREATE TABLE ... PARTITION OF
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.create_learning_events_partition(month_start DATE)
+RETURNS VOID AS $$
+DECLARE
+    from_date DATE := date_trunc('month', month_start)::DATE;
+    to_date DATE := (date_trunc('month', month_start) + INTERVAL '1 month')::DATE;
+    partition_name TEXT := 'learning_events_' || to_char(from_date, 'YYYYMM');
+BEGIN
+    IF to_regclass('t_p66738329_webapp_functionality.' || partition_name) IS NOT NULL THEN
+        RETURN;
+    END IF;
+
+    CREATE TEMP TABLE learning_events_rerouted (LIKE t_p66738329_webapp_functionality.learning_events);
+
+    INSERT INTO learning_events_rerouted
+    SELECT * FROM t_p66738329_webapp_functionality.learning_events_default
+    WHERE occurred_at >= from_date AND occurred_at < to_date;
+
+    DELETE FROM t_p66738329_webapp_functionality.learning_events_default
+    WHERE occurred_at >= from_date AND occurred_at < to_date;
+
+    EXECUTE format(
+        'CREATE TABLE t_p66738329_webapp_functionality.%I PARTITION OF t_p66738329_webapp_functionality.learning_events FOR VALUES FROM (%L) TO (%L)',
+        partition_name, from_date, to_date
+    );
+
+    INSERT INTO t_p66738329_webapp_functionality.learning_events
+    SELECT * FROM learning_events_rerouted;
+
+    DROP TABLE learning_events_rerouted;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,71 @@
+-- Сводки прохождения курсов: статус NULL не учитывается как начатый/завершенный,
+-- удаление сотрудника вычитает его назначения и прогресс
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.course_progress_rollup()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_department_id INTEGER;
+    v_company_id INTEGER;
+BEGIN
+    SELECT department_id, company_id INTO v_department_id, v_company_id
+    FROM t_p66738329_webapp_functionality.users
+    WHERE id = CASE WHEN TG_OP = 'DELETE' THEN OLD.user_id ELSE NEW.user_id END;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM t_p66738329_webapp_functionality.add_course_rollup(
+            v_department_id, v_company_id, OLD.course_id, 0,
+            -COALESCE(OLD.status IN ('in_progress', 'completed'), FALSE)::int, -COALESCE(OLD.status = 'completed', FALSE)::int,
+            -COALESCE(OLD.progress_percent, 0));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM t_p66738329_webapp_functionality.add_course_rollup(
+            v_department_id, v_company_id, NEW.course_id, 0,
+            COALESCE(NEW.status IN ('in_progress', 'completed'), FALSE)::int, COALESCE(NEW.status = 'completed', FALSE)::int,
+            COALESCE(NEW.progress_percent, 0));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Перевод сотрудника переносит его вклад, удаление вычитает его; при удалении выполняется до удаления строки,
+-- пока прогресс сотрудника еще на месте (триггер прогресса после удаления сотрудника его уже не найдет)
+CREATE OR REPLACE FUNCTION t_p66738329_webapp_functionality.users_course_rollup()
+RETURNS TRIGGER AS $$
+DECLARE
+    r RECORD;
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.department_id IS NOT DISTINCT FROM NEW.department_id AND OLD.company_id IS NOT DISTINCT FROM NEW.company_id THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        FOR r IN SELECT course_id FROM t_p66738329_webapp_functionality.course_departments WHERE department_id = OLD.department_id LOOP
+            PERFORM t_p66738329_webapp_functionality.add_course_rollup(OLD.department_id, OLD.company_id, r.course_id, -1, 0, 0, 0);
+        END LOOP;
+        FOR r IN SELECT course_id, status, progress_percent FROM t_p66738329_webapp_functionality.course_progress WHERE user_id = OLD.id LOOP
+            PERFORM t_p66738329_webapp_functionality.add_course_rollup(
+                OLD.department_id, OLD.company_id, r.course_id, 0,
+                -COALESCE(r.status IN ('in_progress', 'completed'), FALSE)::int, -COALESCE(r.status = 'completed', FALSE)::int,
+                -COALESCE(r.progress_percent, 0));
+        END LOOP;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+
+    FOR r IN SELECT course_id FROM t_p66738329_webapp_functionality.course_departments WHERE department_id = NEW.department_id LOOP
+        PERFORM t_p66738329_webapp_functionality.add_course_rollup(NEW.department_id, NEW.company_id, r.course_id, 1, 0, 0, 0);
+    END LOOP;
+    FOR r IN SELECT course_id, status, progress_percent FROM t_p66738329_webapp_functionality.course_progress WHERE user_id = NEW.id LOOP
+        PERFORM t_p66738329_webapp_functionality.add_course_rollup(
+            NEW.department_id, NEW.company_id, r.course_id, 0,
+            COALESCE(r.status IN ('in_progress', 'completed'), FALSE)::int, COALESCE(r.status = 'completed', FALSE)::int,
+            COALESCE(r.progress_percent, 0));
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_users_course_rollup_delete
+BEFORE DELETE ON t_p66738329_webapp_functionality.users
+FOR EACH ROW EXECUTE FUNCTION t_p66738329_webapp_functionality.users_course_rollup();